@@ -0,0 +1,112 @@
+import collections
+import logging
+import random
+import threading
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionCancelled(Exception):
+    # The caller's cancelled() turned true before it was admitted or retried
+    pass
+
+
+# --- Token bucket with a FIFO wait queue ---
+class AdmissionController:
+    # Callers are admitted strictly in arrival order at rate_per_minute on
+    # average, with up to `burst` admitted back-to-back after a quiet spell.
+    # Background callers (speculative requests) have their own queue and only
+    # get a token when no regular caller is waiting and one would be left over.
+    # rate_per_minute=None admits everyone at once (no limit configured).
+    def __init__(self, rate_per_minute, burst=1):
+        self.rate = rate_per_minute / 60.0 if rate_per_minute else None
+        self.capacity = max(1, burst)
+        self.background_reserve = 1 if self.capacity > 1 else 0
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._background = collections.deque()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, on_wait=None, poll_interval=0.5, background=False, cancelled=None):
+        # on_wait(position) is called (outside the lock) while the caller is
+        # queued; position 1 means next in line. cancelled() is checked on every
+        # wake-up, and if true the ticket leaves the queue without a token.
+        if self.rate is None:
+            if cancelled is not None and cancelled():
+                raise AdmissionCancelled()
+            return
+        queue = self._background if background else self._queue
+        needed = 1 + (self.background_reserve if background else 0)
+        ticket = object()
+        with self._cond:
+            queue.append(ticket)
+        last_position = None
+        try:
+            while True:
+                if cancelled is not None and cancelled():
+                    raise AdmissionCancelled()
+                with self._cond:
+                    position = queue.index(ticket) + 1
+                    if position == 1 and not (background and self._queue):
+                        self._refill()
+                        if self._tokens >= needed:
+                            self._tokens -= 1
+                            queue.popleft()
+                            self._cond.notify_all()
+                            return
+                        timeout = min(poll_interval, (needed - self._tokens) / self.rate)
+                    else:
+                        timeout = poll_interval
+                    if position == last_position:
+                        self._cond.wait(timeout)
+                        continue
+                if on_wait is not None:
+                    on_wait(position)
+                last_position = position
+        except BaseException:
+            with self._cond:
+                if ticket in queue:
+                    queue.remove(ticket)
+                    self._cond.notify_all()
+            raise
+
+
+# --- Retry with jittered backoff ---
+def is_retryable(error):
+    from openai import APIConnectionError
+    if isinstance(error, APIConnectionError):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def call_with_admission(controller, fn, on_wait=None, on_retry=None, max_attempts=5,
+                        base_delay=1.0, max_delay=30.0, background=False, cancelled=None):
+    # Every attempt, including retries, goes back through the admission queue
+    # so retries cannot push the process over its configured rate. Raises
+    # AdmissionCancelled once cancelled() is true, before spending a token.
+    for attempt in range(1, max_attempts + 1):
+        with metrics.timer("openai_queue_wait_seconds", priority="background" if background else "regular"):
+            controller.acquire(on_wait=on_wait, background=background, cancelled=cancelled)
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_attempts or not is_retryable(e):
+                metrics.inc("openai_failures_total", error=type(e).__name__)
+                raise
+            metrics.inc("openai_retries_total", error=type(e).__name__)
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            logger.warning("OpenAI call failed (%s), retry %d in %.1fs", e, attempt, delay)
+            if cancelled is not None and cancelled():
+                raise AdmissionCancelled() from e
+            if on_retry is not None:
+                on_retry(attempt, delay)
+            time.sleep(delay)
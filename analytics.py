@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import threading
+import time
+
+RUBRICS = ("evidence", "explanation")
+STAGES = ("first", "last")
+
+
+def _normalize_question(text):
+    return " ".join(str(text or "").lower().split())
+
+
+# --- Parsed results plus incrementally maintained aggregates ---
+class AnalyticsStore:
+    # record_report() updates every aggregate table in the same transaction as
+    # the report row, so the analytics page only ever reads small summary
+    # tables and never scans the reports themselves.
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS reports (
+                session_id TEXT PRIMARY KEY,
+                teacher TEXT NOT NULL,
+                research_question TEXT NOT NULL,
+                rounds INTEGER NOT NULL,
+                first_evidence REAL,
+                first_explanation REAL,
+                last_evidence REAL,
+                last_explanation REAL,
+                created REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS teacher_totals (
+                teacher TEXT PRIMARY KEY,
+                reports INTEGER NOT NULL,
+                rounds INTEGER NOT NULL,
+                last_report REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS question_totals (
+                teacher TEXT NOT NULL,
+                question_key TEXT NOT NULL,
+                research_question TEXT NOT NULL,
+                reports INTEGER NOT NULL,
+                rounds INTEGER NOT NULL,
+                last_evidence_sum REAL NOT NULL,
+                last_evidence_count INTEGER NOT NULL,
+                last_explanation_sum REAL NOT NULL,
+                last_explanation_count INTEGER NOT NULL,
+                PRIMARY KEY (teacher, question_key)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS score_counts (
+                teacher TEXT NOT NULL,
+                rubric TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                score REAL NOT NULL,
+                reports INTEGER NOT NULL,
+                PRIMARY KEY (teacher, rubric, stage, score)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS round_counts (
+                teacher TEXT NOT NULL,
+                rounds INTEGER NOT NULL,
+                reports INTEGER NOT NULL,
+                PRIMARY KEY (teacher, rounds)
+            ) WITHOUT ROWID;"""
+        )
+
+    def record_report(self, session_id, teacher, research_question, rounds, first_scores, last_scores):
+        # Idempotent per session: a report already recorded is left alone.
+        # first_scores / last_scores map rubric name to a score (or None).
+        # "last" is the most recent assessment the student saw, i.e. of the draft
+        # before the one submitted with Finish; the finished draft is not assessed.
+        teacher = teacher.strip().lower()
+        now = time.time()
+        scores = {"first": first_scores or {}, "last": last_scores or {}}
+        last_evidence = scores["last"].get("evidence")
+        last_explanation = scores["last"].get("explanation")
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO reports (session_id, teacher, research_question, rounds, "
+                    "first_evidence, first_explanation, last_evidence, last_explanation, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (session_id, teacher, research_question, rounds,
+                     scores["first"].get("evidence"), scores["first"].get("explanation"),
+                     last_evidence, last_explanation, now),
+                ).rowcount
+                if not inserted:
+                    self._conn.execute("COMMIT")
+                    return False
+
+                self._conn.execute(
+                    "INSERT INTO teacher_totals (teacher, reports, rounds, last_report) VALUES (?, 1, ?, ?) "
+                    "ON CONFLICT(teacher) DO UPDATE SET reports = reports + 1, "
+                    "rounds = rounds + excluded.rounds, last_report = excluded.last_report",
+                    (teacher, rounds, now),
+                )
+                self._conn.execute(
+                    "INSERT INTO question_totals VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(teacher, question_key) DO UPDATE SET reports = reports + 1, "
+                    "rounds = rounds + excluded.rounds, "
+                    "last_evidence_sum = last_evidence_sum + excluded.last_evidence_sum, "
+                    "last_evidence_count = last_evidence_count + excluded.last_evidence_count, "
+                    "last_explanation_sum = last_explanation_sum + excluded.last_explanation_sum, "
+                    "last_explanation_count = last_explanation_count + excluded.last_explanation_count",
+                    (teacher, _normalize_question(research_question), research_question.strip(), rounds,
+                     last_evidence or 0.0, int(last_evidence is not None),
+                     last_explanation or 0.0, int(last_explanation is not None)),
+                )
+                for stage in STAGES:
+                    for rubric in RUBRICS:
+                        score = scores[stage].get(rubric)
+                        if score is None:
+                            continue
+                        self._conn.execute(
+                            "INSERT INTO score_counts VALUES (?, ?, ?, ?, 1) "
+                            "ON CONFLICT(teacher, rubric, stage, score) DO UPDATE SET reports = reports + 1",
+                            (teacher, rubric, stage, score),
+                        )
+                self._conn.execute(
+                    "INSERT INTO round_counts VALUES (?, ?, 1) "
+                    "ON CONFLICT(teacher, rounds) DO UPDATE SET reports = reports + 1",
+                    (teacher, rounds),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return True
+
+    # --- Reads (teacher=None means every teacher) ---
+    def _select(self, sql, teacher, group_by=""):
+        where = ""
+        params = ()
+        if teacher is not None:
+            where = " WHERE teacher = ?"
+            params = (teacher.strip().lower(),)
+        with self._lock:
+            return self._conn.execute(sql + where + group_by, params).fetchall()
+
+    def teachers(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT teacher, reports, rounds, last_report FROM teacher_totals ORDER BY teacher"
+            ).fetchall()
+        return [
+            {"teacher": teacher, "reports": reports, "rounds": rounds, "last_report": last_report}
+            for teacher, reports, rounds, last_report in rows
+        ]
+
+    def totals(self, teacher=None):
+        reports, rounds = self._select(
+            "SELECT COALESCE(SUM(reports), 0), COALESCE(SUM(rounds), 0) FROM teacher_totals", teacher
+        )[0]
+        return {
+            "reports": reports,
+            "rounds": rounds,
+            "average_rounds": rounds / reports if reports else None,
+        }
+
+    def score_distribution(self, teacher=None):
+        rows = self._select(
+            "SELECT rubric, stage, score, SUM(reports) FROM score_counts",
+            teacher,
+            " GROUP BY rubric, stage, score ORDER BY rubric, stage, score",
+        )
+        return [
+            {"rubric": rubric, "stage": stage, "score": score, "reports": reports}
+            for rubric, stage, score, reports in rows
+        ]
+
+    def round_distribution(self, teacher=None):
+        rows = self._select(
+            "SELECT rounds, SUM(reports) FROM round_counts", teacher, " GROUP BY rounds ORDER BY rounds"
+        )
+        return [{"rounds": rounds, "reports": reports} for rounds, reports in rows]
+
+    def research_questions(self, teacher=None, limit=50):
+        rows = self._select(
+            "SELECT MIN(research_question), SUM(reports), SUM(rounds), "
+            "SUM(last_evidence_sum), SUM(last_evidence_count), "
+            "SUM(last_explanation_sum), SUM(last_explanation_count) FROM question_totals",
+            teacher,
+            f" GROUP BY question_key ORDER BY SUM(reports) DESC LIMIT {int(limit)}",
+        )
+        return [
+            {
+                "research_question": question,
+                "reports": reports,
+                "average_rounds": rounds / reports,
+                "average_last_evidence": evidence_sum / evidence_count if evidence_count else None,
+                "average_last_explanation": explanation_sum / explanation_count if explanation_count else None,
+            }
+            for question, reports, rounds, evidence_sum, evidence_count, explanation_sum, explanation_count in rows
+        ]
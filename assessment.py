@@ -0,0 +1,275 @@
+import collections
+import hashlib
+import logging
+import re
+import metrics
+from response_cache import make_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+# --- Prompt ---
+MODEL = "gpt-4o"
+TEMPERATURE = 0.7
+# Bump whenever the prompt text changes so cached responses are not reused
+PROMPT_VERSION = "5"
+FOLLOWUP_MARKER = "Follow-Up Questions:"
+
+
+# Everything that does not depend on the student comes first and is identical
+# on every call, so the provider can serve it from its prompt-prefix cache.
+RUBRIC_PROMPT = """You are assessing student science investigation reflections using two rubrics:
+
+Rubric 1: Presenting Evidence
+- 1 ("Getting There"): Lists what they saw, measured, or noticed; points to evidence but does not clearly connect it to the research question.
+- 2 ("Partial Solid"): Includes some relevant evidence, but descriptions are general OR misses patterns, contrasts, or possible relationships.
+- 3 ("Solid"): Presents a range of specific evidence clearly tied to the research question AND describes key patterns, contrasts, or cause-effect relationships.
+- 4 ("Excellent"): Selects specific, relevant evidence; describes patterns or relationships; AND highlights limitations, uncertainty, or suggests additional data that would improve clarity.
+
+Rubric 2: Constructing an Explanation
+- 1 ("Getting There"): Says what they think the evidence means; suggests a reason but without clear logical flow.
+- 2 ("Partial Solid"): Begins to connect evidence to reasoning, but the logic is incomplete OR cause-effect ideas are missing or unclear.
+- 3 ("Solid"): Strings together a clear explanation that spells out cause-effect connections explcitly with mechanisms or clear reasoning. Answers the research question AND shows how evidence backs up the explanation through cause-and-effect.
+- 4 ("Excellent"): Builds a cause-effect explanation AND connects it to scientific ideas (energy flow, matter changes, or scale/quantity); recognizes gaps, limitations, or alternative explanations.
+
+---
+
+Scoring Rules:
+- Match your reasoning explicitly to rubric words like "specific evidence," "patterns," "cause-effect," "uncertainty," "additional data."
+- Give a range of possible scores, using half scores if needed.
+- Use the second person to refer to the student personally.
+- Be brief but clear: 1-2 sentences justifying each score, focusing only on the positive items completed.
+
+Follow-Up Question Rules:
+- If either score is 1 or 2, start with a comment along the lines of: "This feedback is meant to guide you to immediately improve your work. Use these questions to guide your revision, then submit."
+- If Evidence Score is 1 → Ask for more specific evidence, closely connected to the research question.
+- If Evidence Scores is 2 → Ask for patterns, contrasts, or clearer tie to research question.
+- If Evidence Score is 3 → Ask about uncertainty, limitations, or additional data that could strengthen the evidence.
+- If Evidence Score is 4 → Ask about generalizing to new materials, conditions, or variables.
+- If Explanation Score is 1 → Ask for a clear reason why things happened how they did, using cause-effect.
+- If Explanation Score is 2 → Ask for stronger cause-effect reasoning that ties evidence directly to the research question.
+- If Explanation Score is 3 → Ask for connection to scientific ideas (energy, matter, or scale) OR recognition of possible gaps or alternatives.
+- If Explanation Score is 4 → Ask for deeper particle-level reasoning OR critical evaluation of alternative explanations.
+
+All follow-up questions must be open-ended (cannot be answered "yes" or "no").
+
+---
+
+Instructions:
+- Provide friendly, clear rubric-based reasoning for evidence and explanation.
+- Assign 1–4 scores for each.
+- Write two open-ended follow-up questions (one for evidence, one for explanation) that push the student one level higher based on their scores.
+- Do not repeat any already-asked questions.
+
+Return your response cleanly structured like this:
+
+Assessment:
+- Evidence: Evidence Score: [number]  
+- Explanation: Explanation Score: [number]
+
+Follow-Up Questions:
+- Evidence Question: [question here]
+- Explanation Question: [question here]
+"""
+
+
+def asked_questions(history):
+    asked = []
+    for h in history:
+        asked.append(h["question"]["evidence_q"])
+        asked.append(h["question"]["explanation_q"])
+    return asked
+
+
+# --- History compaction ---
+# Only the last RECENT_ROUNDS rounds go into the prompt word for word. Older
+# rounds are folded into a short list of topics, so the prompt stays about the
+# same size however many times a group revises.
+RECENT_ROUNDS = 3
+MAX_TOPICS = 12
+
+_STOPWORDS = frozenset("""
+a about an and any are as at be been but by can could did do does for from has have how if in
+into is it its may might more most of on or other over so some such than that the their them
+then there these they this those to was were what when where which while who why will with
+would you your yours
+""".split())
+
+
+# Words that show up in almost any follow-up question and say nothing about
+# its topic; left out of the earlier-rounds summary only
+_QUESTION_WORDS = frozenset("""
+about account across additional affect affects after again also alternative another because
+before between cause caused causes change changed changes compare consider data describe
+difference differences different does each effect effects evidence example examples explain
+explanation happen happened happening help helps idea ideas know level like limitation
+limitations make makes many much need notice noticed observe observed observations pattern
+patterns reason reasoning reasons reliable result results same show shows specific strengthen
+stronger support supports tell there think time times uncertainty using ways what when where
+which while your
+""".split())
+
+
+def question_fingerprint(question):
+    # Ignores case, punctuation, filler words and word order, so light
+    # rewordings of the same question collide
+    words = sorted(set(re.findall(r"[a-z0-9]+", str(question or "").lower())) - _STOPWORDS)
+    return hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=6).hexdigest()
+
+
+def compact_history(history, recent_rounds=RECENT_ROUNDS, max_topics=MAX_TOPICS):
+    topics = collections.Counter()
+    fingerprints = set()
+    for h in history[:-recent_rounds] if recent_rounds else history:
+        for question in (h["question"]["evidence_q"], h["question"]["explanation_q"]):
+            fingerprints.add(question_fingerprint(question))
+            topics.update(set(re.findall(r"[a-z]{4,}", str(question or "").lower())) - _STOPWORDS - _QUESTION_WORDS)
+    recent = asked_questions(history[-recent_rounds:] if recent_rounds else [])
+    fingerprints.update(question_fingerprint(q) for q in recent)
+    return {
+        "recent": recent,
+        # Ties are broken alphabetically so the prompt and the cache key are
+        # the same in every process (set order depends on PYTHONHASHSEED)
+        "earlier_topics": [word for word, _ in sorted(topics.items(), key=lambda kv: (-kv[1], kv[0]))[:max_topics]],
+        "fingerprints": fingerprints,
+    }
+
+
+def repeated_questions(parsed, history):
+    # New questions that match one already asked in any earlier round
+    fingerprints = compact_history(history)["fingerprints"]
+    return [
+        q for q in (parsed["evidence_q"], parsed["explanation_q"])
+        if q and question_fingerprint(q) in fingerprints
+    ]
+
+
+def build_student_message(initial_answers, history, avoid=()):
+    # avoid: questions the model just repeated, listed so it does not again
+    context = compact_history(history)
+    earlier = ""
+    if context["earlier_topics"]:
+        earlier = f"Earlier Rounds Also Asked About: {', '.join(context['earlier_topics'])}\n"
+    return f"""Now assess this new student:
+
+Student Initial Answers:
+- Research Question: {initial_answers['research_question']}
+- Present Evidence: {initial_answers['evidence']}
+- Construct an Explanation: {initial_answers['meaning']}
+
+Already Asked Questions: {context['recent'] + list(avoid)}
+{earlier}"""
+
+
+def build_followup_messages(initial_answers, history, avoid=()):
+    return [
+        {"role": "system", "content": RUBRIC_PROMPT},
+        {"role": "user", "content": build_student_message(initial_answers, history, avoid)},
+    ]
+
+
+# --- Parsing ---
+_SCORE_PATTERNS = {
+    # [*_\s]* lets markdown emphasis through, e.g. "**Evidence Score**: 2"
+    key: re.compile(label + r"[*_\s]*Score[*_\s]*:\W*(\d(?:\.\d+)?)(?:\s*(?:-|–|to)\s*(\d(?:\.\d+)?))?",
+                    re.IGNORECASE)
+    for key, label in (("evidence_score", "Evidence"), ("explanation_score", "Explanation"))
+}
+
+
+def parse_scores(assessment):
+    # A range like "2-3" is reported as its midpoint
+    scores = {}
+    for key, pattern in _SCORE_PATTERNS.items():
+        match = pattern.search(assessment)
+        if match is None:
+            scores[key] = None
+        elif match.group(2):
+            scores[key] = (float(match.group(1)) + float(match.group(2))) / 2
+        else:
+            scores[key] = float(match.group(1))
+    return scores
+
+
+def _match_question(line, label):
+    # Also matches "- **Evidence Question:** ..." and "**Evidence Question**: ..."
+    match = re.match(r"[-*•_\s]*" + re.escape(label) + r"[*_\s]*:[*_\s]*(.*)$", line.strip(), re.IGNORECASE)
+    return match.group(1).strip() if match else None
+
+
+def parse_followup(text, complete=True):
+    # Works on partial output: a question only counts once its line has ended
+    # (or the response is complete), so it can be shown as soon as it is final.
+    assessment, marker, questions = text.partition(FOLLOWUP_MARKER)
+    if not marker and not complete:
+        for k in range(len(FOLLOWUP_MARKER) - 1, 0, -1):
+            if assessment.endswith(FOLLOWUP_MARKER[:k]):
+                assessment = assessment[:-k]
+                break
+
+    parsed = {
+        "assessment": assessment.strip(),
+        "evidence_q": None,
+        "explanation_q": None,
+    }
+    parsed.update(parse_scores(parsed["assessment"]))
+    if not marker:
+        return parsed
+
+    lines = questions.split("\n")
+    if not complete:
+        lines = lines[:-1]
+    lines = [line for line in lines if line.strip()]
+    for line in lines:
+        evidence_q = _match_question(line, "Evidence Question")
+        if evidence_q is not None and parsed["evidence_q"] is None:
+            parsed["evidence_q"] = evidence_q
+        explanation_q = _match_question(line, "Explanation Question")
+        if explanation_q is not None and parsed["explanation_q"] is None:
+            parsed["explanation_q"] = explanation_q
+
+    # Fall back to line order if the labels were dropped
+    if complete and parsed["evidence_q"] is None and parsed["explanation_q"] is None and len(lines) >= 2:
+        parsed["evidence_q"] = lines[0].strip()
+        parsed["explanation_q"] = lines[1].strip()
+    return parsed
+
+
+# --- Cache Key ---
+def followup_cache_key(initial_answers, history, model=MODEL):
+    # Keyed on what the prompt actually contains, not the full history
+    context = compact_history(history)
+    return make_cache_key(
+        initial_answers["research_question"],
+        initial_answers["evidence"],
+        initial_answers["meaning"],
+        context["recent"] + [f"earlier: {' '.join(context['earlier_topics'])}"],
+        model,
+        PROMPT_VERSION,
+    )
+
+
+# --- Token accounting ---
+def record_usage(usage, latency, model=MODEL, source="app"):
+    # usage is the OpenAI usage object (None if the API did not return one)
+    details = getattr(usage, "prompt_tokens_details", None)
+    accounting = {
+        "source": source,
+        "model": model,
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "latency_ms": round(latency * 1000),
+    }
+    metrics.inc("openai_calls_total", source=source, model=model)
+    metrics.observe("openai_call_seconds", latency, source=source, model=model)
+    for kind in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+        if accounting[kind]:
+            metrics.inc(f"openai_{kind}_total", accounting[kind], source=source, model=model)
+    logger.info(
+        "openai call source=%(source)s model=%(model)s prompt_tokens=%(prompt_tokens)s "
+        "cached_tokens=%(cached_tokens)s completion_tokens=%(completion_tokens)s "
+        "latency_ms=%(latency_ms)s",
+        accounting,
+    )
+    return accounting
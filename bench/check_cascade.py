@@ -0,0 +1,60 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fake_servers import CANNED_ASSESSMENT, StubOpenAI  # noqa: E402
+from cascade import Cascade, split_confidence  # noqa: E402
+
+FAST = "fast"
+ANSWERS = {"research_question": "Does water temperature change how fast sugar dissolves?",
+           "evidence": "Hot water: 25 s. Cold water: 180 s.", "meaning": "Heat makes it dissolve faster."}
+
+
+def fast_reply(evidence_score="3", explanation_score="2", confidence="Confidence: 90", n=1):
+    text = CANNED_ASSESSMENT.format(evidence_score=evidence_score, explanation_score=explanation_score, n=n)
+    return text + confidence + "\n"
+
+
+def asked(n):
+    # One earlier round that asked the canned questions for trial n
+    text = CANNED_ASSESSMENT.format(evidence_score=2, explanation_score=2, n=n)
+    questions = text.split("Follow-Up Questions:")[1].strip().split("\n")
+    return [{"question": {"evidence_q": questions[0].split(": ", 1)[1],
+                          "explanation_q": questions[1].split(": ", 1)[1]}}]
+
+
+# (name, fast model reply, history, expected escalation reason; None = accepted)
+CASES = [
+    ("confident whole scores", fast_reply(), [], None),
+    ("markdown scores", fast_reply().replace("Evidence Score:", "**Evidence Score**:"), [], None),
+    ("score range", fast_reply(evidence_score="2-3"), [], "borderline"),
+    ("half score", fast_reply(explanation_score="2.5"), [], "borderline"),
+    ("low confidence", fast_reply(confidence="Confidence: 60%"), [], "low_confidence"),
+    ("no confidence line", fast_reply(confidence=""), [], "no_confidence"),
+    ("no questions", fast_reply().split("Follow-Up Questions:")[0] + "Confidence: 95", [], "unparsed"),
+    ("repeats an earlier round", fast_reply(n=1), asked(1), "repeated"),
+    ("new question after a round", fast_reply(n=2), asked(1), None),
+]
+
+
+def main():
+    failures = 0
+    for name, reply, history, expected in CASES:
+        client = StubOpenAI({FAST: reply})
+        text, reason = Cascade(client, fast_model=FAST).first_pass(ANSWERS, history)
+        ok = reason == expected and (text is None) == (expected is not None) and client.calls == [FAST]
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: escalation={reason!r} (expected {expected!r})")
+
+    for line, expected in (("Confidence: 85", 0.85), ("- **Confidence:** 70%", 0.7), ("Confidence: 150", 1.0)):
+        _, confidence = split_confidence("Assessment:\n" + line)
+        ok = confidence == expected
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} split_confidence({line!r}) = {confidence} (expected {expected})")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
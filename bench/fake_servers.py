@@ -0,0 +1,258 @@
+import itertools
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_ASSESSMENT = """Assessment:
+- Evidence: You listed several measurements tied to your question. Evidence Score: {evidence_score}
+- Explanation: You suggest a reason, but the cause-effect link is still loose. Explanation Score: {explanation_score}
+
+Follow-Up Questions:
+- Evidence Question: What pattern do you notice across trial {n}, and how does it connect to your research question?
+- Explanation Question: What is happening to the energy in the system in trial {n} that could cause the change you measured?
+"""
+
+
+# --- Shared fake server behaviour ---
+class FakeBackend:
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=429):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def should_fail(self):
+        with self._lock:
+            self.requests += 1
+            if random.random() < self.error_rate:
+                self.errors += 1
+                return True
+        return False
+
+    def delay(self, latency=None):
+        latency = self.latency if latency is None else latency
+        if latency:
+            time.sleep(latency * random.uniform(0.8, 1.2))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_failure(self, backend):
+        status = backend.error_status
+        headers = {"retry-after": "0.2"} if status == 429 else None
+        self.send_json(status, {"error": {"message": "fake failure", "type": "fake", "code": status}}, headers)
+
+
+# --- Fake OpenAI chat completions ---
+def fake_usage(messages, text, seen_prefixes):
+    # Roughly how OpenAI reports prompt caching: nothing under 1024 tokens,
+    # then the repeated system prefix in 128-token steps, from the second call
+    # with that prefix on. Tokens are estimated at 4 characters each.
+    system = "".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+    prefix_tokens = len(system) // 4
+    cached = 0
+    if system in seen_prefixes and prefix_tokens >= 1024:
+        cached = 1024 + (prefix_tokens - 1024) // 128 * 128
+    seen_prefixes.add(system)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4,
+            "total_tokens": prompt_tokens + len(text) // 4,
+            "prompt_tokens_details": {"cached_tokens": cached}}
+
+
+def wants_confidence(messages):
+    return any("Confidence:" in (m.get("content") or "") for m in messages if m.get("role") == "system")
+
+
+# Like the real models: the rubric prompt asks for ranges, while the cascade's
+# fast pass is asked for whole scores (and ignores that now and then)
+FULL_SCORES = ["1", "1-2", "2", "2-3", "3", "3-4", "4"]
+FAST_SCORES = ["1", "2", "3", "4"]
+
+
+def canned_completion(n, confident_rate=1.0, with_confidence=False):
+    choices = FULL_SCORES if not with_confidence or random.random() < 0.1 else FAST_SCORES
+    text = CANNED_ASSESSMENT.format(
+        evidence_score=random.choice(choices),
+        explanation_score=random.choice(choices),
+        n=n,
+    )
+    if with_confidence:
+        text += f"Confidence: {90 if random.random() < confident_rate else 50}\n"
+    return text
+
+
+class FakeOpenAI(FakeBackend):
+    # latency is the time to first token (model_latency overrides it per
+    # model); token_delay is added per streamed chunk. Cascade first passes get
+    # a high confidence line for `confident_rate` of calls.
+    def __init__(self, latency=0.5, token_delay=0.01, error_rate=0.0, error_status=429,
+                 model_latency=None, confident_rate=0.7):
+        super().__init__(latency, error_rate, error_status)
+        self.token_delay = token_delay
+        self.model_latency = model_latency or {}
+        self.confident_rate = confident_rate
+        self.models = {}
+        self.seen_prefixes = set()
+        self._counter = itertools.count(1)
+
+    def completion_text(self, request=None):
+        messages = (request or {}).get("messages") or []
+        return canned_completion(next(self._counter), self.confident_rate, wants_confidence(messages))
+
+    def handler(self):
+        backend = self
+
+        class Handler(_Handler):
+            def do_POST(self):
+                request = json.loads(self.read_body() or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self.send_json(404, {"error": {"message": "not found"}})
+                    return
+                model = request.get("model", "fake")
+                with backend._lock:
+                    backend.models[model] = backend.models.get(model, 0) + 1
+                backend.delay(backend.model_latency.get(model))
+                if backend.should_fail():
+                    self.send_failure(backend)
+                    return
+                text = backend.completion_text(request)
+                with backend._lock:
+                    usage = fake_usage(request.get("messages") or [], text, backend.seen_prefixes)
+                if request.get("stream"):
+                    try:
+                        self.stream(request, text, usage)
+                    except (BrokenPipeError, ConnectionResetError):
+                        # The client closed a cancelled stream
+                        self.close_connection = True
+                else:
+                    self.send_json(200, {
+                        "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                        "model": request.get("model", "fake"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": text}}],
+                        "usage": usage,
+                    })
+
+            def stream(self, request, text, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk",
+                        "created": int(time.time()), "model": request.get("model", "fake")}
+                words = text.split(" ")
+                for idx, word in enumerate(words):
+                    piece = word if idx == len(words) - 1 else word + " "
+                    chunk = dict(base, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if backend.token_delay:
+                        time.sleep(backend.token_delay)
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    chunk = dict(base, choices=[], usage=usage)
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+# --- Fake Google token endpoint + Gmail send ---
+class FakeGmail(FakeBackend):
+    def __init__(self, latency=0.2, error_rate=0.0, error_status=500, token_latency=0.1):
+        super().__init__(latency, error_rate, error_status)
+        self.token_latency = token_latency
+        self.token_requests = 0
+        self.sent = []
+
+    def handler(self):
+        backend = self
+
+        class Handler(_Handler):
+            def do_POST(self):
+                body = self.read_body()
+                if self.path.rstrip("/").endswith("/token"):
+                    backend.token_requests += 1
+                    time.sleep(backend.token_latency)
+                    self.send_json(200, {"access_token": "fake-token", "expires_in": 3600,
+                                         "token_type": "Bearer", "scope": "https://www.googleapis.com/auth/gmail.send"})
+                    return
+                if not self.path.split("?")[0].endswith("/messages/send"):
+                    self.send_json(404, {"error": {"message": "not found"}})
+                    return
+                backend.delay()
+                if backend.should_fail():
+                    self.send_failure(backend)
+                    return
+                with backend._lock:
+                    backend.sent.append((time.monotonic(), json.loads(body or b"{}")))
+                    message_id = f"fake-{len(backend.sent)}"
+                self.send_json(200, {"id": message_id, "threadId": message_id, "labelIds": ["SENT"]})
+
+        return Handler
+
+
+# --- In-process stub of the OpenAI client ---
+class StubOpenAI:
+    # Enough of openai.OpenAI for the cascade's non-streamed first pass,
+    # without a server. replies maps a model name to its text, or to a function
+    # of the messages; other models get a canned answer.
+    def __init__(self, replies=None, confident_rate=1.0):
+        self.replies = replies or {}
+        self.confident_rate = confident_rate
+        self.calls = []
+        self._counter = itertools.count(1)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        self.calls.append(model)
+        reply = self.replies.get(model)
+        if callable(reply):
+            text = reply(messages)
+        elif reply is not None:
+            text = reply
+        else:
+            text = canned_completion(next(self._counter), self.confident_rate, wants_confidence(messages))
+        usage = fake_usage(messages, text, set())
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, finish_reason="stop",
+                                     message=SimpleNamespace(role="assistant", content=text))],
+            usage=SimpleNamespace(
+                prompt_tokens=usage["prompt_tokens"],
+                completion_tokens=usage["completion_tokens"],
+                prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+            ),
+        )
+
+
+def serve(backend, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), backend.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
@@ -0,0 +1,332 @@
+import argparse
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "streamlit_app.py")
+sys.path.insert(0, ROOT)
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+from bench.fake_servers import FakeGmail, FakeOpenAI, serve  # noqa: E402
+from outbox import Outbox, SENT, FAILED  # noqa: E402
+import metrics  # noqa: E402
+
+# share_apptest_globals() patches Streamlit internals (Runtime.instance,
+# ScriptCache, AppTest's config patching, Secrets._secrets) that change between
+# releases; it has only been checked against this one.
+TESTED_STREAMLIT = "1.65"
+
+
+def check_streamlit_version():
+    import streamlit
+    version = ".".join(streamlit.__version__.split(".")[:2])
+    if version != TESTED_STREAMLIT:
+        raise SystemExit(
+            f"bench/run_bench.py was written against Streamlit {TESTED_STREAMLIT}.x, found "
+            f"{streamlit.__version__}. Install streamlit=={TESTED_STREAMLIT}.* to run the bench, "
+            "or re-check share_apptest_globals() against this version and update TESTED_STREAMLIT."
+        )
+
+
+def share_apptest_globals(secrets):
+    # AppTest swaps process-wide globals (the Runtime singleton, st.secrets and
+    # config options) around every run, which breaks the app's background
+    # threads between runs. Install them once per worker process instead, the
+    # way a `streamlit run` server process would have them. AppTest runs are
+    # still not safe to overlap in one process, so each worker drives one
+    # session at a time (see run).
+    import contextlib
+    import streamlit as st
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test, util
+
+    shared_secrets = Secrets()
+    shared_secrets._secrets = secrets
+    st.secrets = shared_secrets
+
+    util.patch_config_options({"global.appTest": True}).__enter__()
+    app_test.patch_config_options = lambda overrides: contextlib.nullcontext()
+
+    last_runtime = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            last_runtime["runtime"] = cls._instance
+        return last_runtime["runtime"]
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: bool(last_runtime) or cls._instance is not None)
+
+    # A real server compiles the script once into a shared ScriptCache;
+    # AppTest makes a new cache per run, which would recompile the app on
+    # every rerun of every session in this worker.
+    original_get_bytecode = ScriptCache.get_bytecode
+    shared_cache = ScriptCache()
+
+    def get_bytecode(self, script_path):
+        return original_get_bytecode(shared_cache, script_path)
+
+    ScriptCache.get_bytecode = get_bytecode
+
+    # The app imports these lazily on first use; load them up front so the
+    # worker's first session is not timed with its cold start
+    import gmail_client  # noqa: F401
+    import openai  # noqa: F401
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def click(at, label):
+    next(button for button in at.button if button.label == label).click()
+    at.run()
+
+
+# --- One simulated group: input -> follow-up rounds -> send summary ---
+# Finished sessions stay referenced, as a server keeps open sessions alive
+_live_sessions = []
+
+
+def counter_values(prefix):
+    values = {}
+    for counter in metrics.REGISTRY.snapshot()["counters"]:
+        if counter["name"].startswith(prefix):
+            key = (counter["name"], tuple(sorted(counter["labels"].items())))
+            values[key] = counter["value"]
+    return values
+
+
+def run_session(idx, args):
+    # Runs in a worker process; returns only plain data
+    rss_before = rss_kb()
+    cascade_before = counter_values("cascade_")
+    session_started = time.time()
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    at.run()
+
+    at.text_input[0].input(f"Student{idx}A, Student{idx}B")
+    at.text_area[0].input("How does the temperature of water affect how fast sugar dissolves?")
+    at.text_area[1].input(f"Trial {idx}: hot water dissolved the sugar in {random.randint(20, 60)} seconds.")
+    at.text_area[2].input("Hot water makes the molecules move faster.")
+    at.text_input[1].input(f"teacher{idx % args.teachers}@example.com")
+
+    latencies = []
+    started = time.perf_counter()
+    click(at, "Submit Answers")
+    latencies.append(time.perf_counter() - started)
+
+    for round_number in range(args.rounds):
+        at.text_area(key="updated_evidence").input(
+            f"Round {round_number}: hot water {random.randint(20, 60)}s, cold water {random.randint(90, 200)}s."
+        )
+        started = time.perf_counter()
+        click(at, "Submit Revisions")
+        latencies.append(time.perf_counter() - started)
+
+    finished_at = time.time()
+    click(at, "Finish and Send Summary")
+    errors = [str(e.value) for e in at.exception] + [e.value for e in at.error]
+    _live_sessions.append(at)
+    cascade_after = counter_values("cascade_")
+    cascade = [
+        (name, dict(labels), value - cascade_before.get((name, labels), 0))
+        for (name, labels), value in cascade_after.items()
+    ]
+    return {"session_id": at.session_state["session_id"], "latencies": latencies,
+            "started_at": session_started, "finished_at": finished_at, "ended_at": time.time(),
+            "errors": errors, "rss_kb": rss_kb() - rss_before, "cascade": cascade}
+
+
+def wait_for_emails(outbox_path, results, timeout):
+    # A reader on the same outbox database; the app's worker does the sending
+    outbox = Outbox(outbox_path, send_fn=None)
+    pending = {r["session_id"]: r for r in results}
+    deadline = time.monotonic() + timeout
+    delivery = []
+    while pending and time.monotonic() < deadline:
+        for session_id in list(pending):
+            status = outbox.status(f"{session_id}:summary")
+            if status and status["status"] in (SENT, FAILED):
+                result = pending.pop(session_id)
+                if status["status"] == SENT:
+                    delivery.append(time.time() - result["finished_at"])
+                else:
+                    result["errors"].append(f"email failed: {status['error']}")
+        time.sleep(0.1)
+    return delivery, len(pending)
+
+
+def run(args):
+    model_latency = {args.cascade_fast_model: args.fast_latency} if args.cascade_fast_model else None
+    openai_backend = FakeOpenAI(args.openai_latency, args.openai_token_delay, args.openai_error_rate,
+                                model_latency=model_latency, confident_rate=args.fast_confident_rate)
+    gmail_backend = FakeGmail(args.gmail_latency, args.gmail_error_rate)
+    _, openai_url = serve(openai_backend)
+    _, gmail_url = serve(gmail_backend)
+
+    workdir = tempfile.mkdtemp(prefix="labreport-bench-")
+    outbox_path = os.path.join(workdir, "outbox.sqlite3")
+    secrets = {
+        "OPENAI_API_KEY": "fake-key",
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "OPENAI_REQUESTS_PER_MINUTE": args.rate_limit,
+        "OPENAI_BURST": args.burst,
+        "RESPONSE_CACHE_PATH": os.path.join(workdir, "responses.sqlite3"),
+        "OUTBOX_PATH": outbox_path,
+        "SESSION_STORE": args.session_store,
+        "SESSION_STORE_PATH": os.path.join(workdir, "sessions.sqlite3"),
+        "ANALYTICS_PATH": os.path.join(workdir, "analytics.sqlite3"),
+        "CASCADE_FAST_MODEL": args.cascade_fast_model,
+        "google_auth": {
+            "refresh_token": "fake-refresh",
+            "client_id": "fake-client",
+            "client_secret": "fake-secret",
+            "token_uri": f"{gmail_url}/token",
+            "api_endpoint": f"{gmail_url}/",
+        },
+    }
+
+    # One app process per concurrent group, each running its sessions one
+    # after another; they share the SQLite cache, outbox and session store
+    # like replicas on one disk would.
+    pool = concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.concurrency,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=share_apptest_globals,
+        initargs=(secrets,),
+    )
+    with pool:
+        results = list(pool.map(run_session, range(args.sessions), itertools.repeat(args)))
+        # Workers (and their outbox senders) must stay up until delivery
+        delivery, undelivered = wait_for_emails(outbox_path, results, args.timeout)
+    # Measured from the first session start, so worker start-up is excluded
+    wall = max(r["ended_at"] for r in results) - min(r["started_at"] for r in results)
+
+    latencies = [latency for r in results for latency in r["latencies"]]
+    first_feedback = [r["latencies"][0] for r in results]
+    errors = [e for r in results for e in r["errors"]]
+    return {
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "rounds": args.rounds,
+        "wall_seconds": round(wall, 3),
+        "sessions_per_second": round(args.sessions / wall, 3),
+        "rounds_per_second": round(len(latencies) / wall, 3),
+        "round_latency_p50": percentile(latencies, 0.50),
+        "round_latency_p95": percentile(latencies, 0.95),
+        "round_latency_max": max(latencies) if latencies else None,
+        "first_feedback_p95": percentile(first_feedback, 0.95),
+        "email_delivery_p95": percentile(delivery, 0.95),
+        "emails_undelivered": undelivered,
+        "memory_per_session_kb": round(sum(r["rss_kb"] for r in results) / max(args.sessions, 1), 1),
+        "openai_requests": openai_backend.requests,
+        "openai_requests_by_model": openai_backend.models,
+        "cascade": cascade_stats([c for r in results for c in r["cascade"]]),
+        "gmail_sends": len(gmail_backend.sent),
+        "gmail_token_requests": gmail_backend.token_requests,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+    }
+
+
+def cascade_stats(counters):
+    # counters are (name, labels, value) deltas collected by each session
+    outcomes = {}
+    saved = overhead = 0.0
+    for name, labels, value in counters:
+        if name == "cascade_total":
+            outcomes[labels["outcome"]] = outcomes.get(labels["outcome"], 0) + value
+        elif name == "cascade_latency_saved_seconds_total":
+            saved += value
+        elif name == "cascade_escalation_overhead_seconds_total":
+            overhead += value
+    calls = sum(outcomes.values())
+    if not calls:
+        return None
+    return {
+        "calls": calls,
+        "escalation_rate": round(outcomes.get("escalated", 0) / calls, 3),
+        "latency_saved_seconds": round(saved - overhead, 3),
+    }
+
+
+def compare(report, baseline, tolerance):
+    # Higher is worse for these; anything more than `tolerance` over baseline fails
+    regressions = []
+    for key in ("round_latency_p95", "first_feedback_p95", "memory_per_session_kb"):
+        old, new = baseline.get(key), report.get(key)
+        if old and new is not None and new > old * (1 + tolerance):
+            regressions.append(f"{key}: {old:.3f} -> {new:.3f}")
+    old, new = baseline.get("sessions_per_second"), report.get("sessions_per_second")
+    if old and new is not None and new < old * (1 - tolerance):
+        regressions.append(f"sessions_per_second: {old:.3f} -> {new:.3f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the app flow against fake OpenAI and Gmail servers.")
+    parser.add_argument("--sessions", type=int, default=20, help="simulated groups (default: 20)")
+    parser.add_argument("--concurrency", type=int, default=10, help="groups running at once (default: 10)")
+    parser.add_argument("--rounds", type=int, default=3, help="revision rounds per group (default: 3)")
+    parser.add_argument("--teachers", type=int, default=3, help="distinct teacher addresses (default: 3)")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="seconds to first token")
+    parser.add_argument("--openai-token-delay", type=float, default=0.005, help="seconds between streamed chunks")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--cascade-fast-model", help="enable the model cascade with this fast model")
+    parser.add_argument("--fast-latency", type=float, default=0.15, help="fast model seconds to first token")
+    parser.add_argument("--fast-confident-rate", type=float, default=0.7,
+                        help="fraction of fast answers that come back confident (default: 0.7)")
+    parser.add_argument("--gmail-latency", type=float, default=0.2)
+    parser.add_argument("--gmail-error-rate", type=float, default=0.0, help="fraction of sends answered with 500")
+    parser.add_argument("--rate-limit", type=float, default=6000, help="OPENAI_REQUESTS_PER_MINUTE for the app")
+    parser.add_argument("--burst", type=int, default=50, help="OPENAI_BURST for the app")
+    parser.add_argument("--session-store", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-run and email delivery timeout")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a previously saved report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression vs baseline (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    check_streamlit_version()
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 1 if report["errors"] or report["emails_undelivered"] else 0
+
+
+if __name__ == "__main__":
+    # Workers unpickle run_session by module name, and AppTest replaces
+    # __main__ with the app script, so run from the importable module
+    from bench.run_bench import main
+    sys.exit(main())
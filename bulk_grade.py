@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, RateLimitError
+from assessment import MODEL, TEMPERATURE, build_followup_messages, parse_followup, followup_cache_key, record_usage
+from response_cache import ResponseCache
+
+FIELDS = ["names", "research_question", "evidence", "meaning"]
+
+
+# --- Input / checkpoint ---
+def read_reflections(path):
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for idx, line in enumerate(f):
+                if line.strip():
+                    row = json.loads(line)
+                    yield str(row.get("id", idx)), row
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            for idx, row in enumerate(csv.DictReader(f)):
+                yield str(row.get("id") or idx), row
+
+
+def completed_ids(output_path):
+    # Rows that errored are retried on the next run, which appends a second
+    # line with the same id; readers should keep the last line per id
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # partial line from an interrupted write
+            if not result.get("error"):
+                done.add(result["id"])
+    return done
+
+
+# --- Rate limiting from response headers ---
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset(value):
+    # Header values look like "1s", "6m0s" or "250ms"
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(n) * _UNITS[unit] for n, unit in _DURATION.findall(value))
+
+
+class HeaderRateLimiter:
+    # Shared by all workers: when the API reports no remaining requests or
+    # tokens, everyone waits for the advertised reset instead of hammering it.
+    def __init__(self):
+        self._resume_at = 0.0
+
+    async def wait(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def update(self, headers):
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and remaining.isdigit() and int(remaining) == 0:
+                self.pause(parse_reset(headers.get(f"x-ratelimit-reset-{kind}")))
+
+
+# --- Grading ---
+async def assess(client, limiter, row, max_attempts):
+    messages = build_followup_messages(row, [])
+    for attempt in range(1, max_attempts + 1):
+        await limiter.wait()
+        try:
+            started = time.perf_counter()
+            raw = await client.chat.completions.with_raw_response.create(
+                model=MODEL,
+                messages=messages,
+                temperature=TEMPERATURE,
+            )
+            limiter.update(raw.headers)
+            response = raw.parse()
+            record_usage(response.usage, time.perf_counter() - started, source="bulk")
+            return response.choices[0].message.content.strip()
+        except (RateLimitError, APIConnectionError, APIStatusError) as e:
+            status = getattr(e, "status_code", None)
+            if attempt == max_attempts or (status is not None and status != 429 and status < 500):
+                raise
+            headers = e.response.headers if getattr(e, "response", None) is not None else {}
+            retry_after = parse_reset(headers.get("retry-after"))
+            delay = retry_after or random.uniform(0, min(60, 2 ** attempt))
+            if status == 429:
+                limiter.pause(delay)
+            await asyncio.sleep(delay)
+
+
+async def grade_row(client, limiter, cache, row_id, row, max_attempts):
+    row = {field: row.get(field, "") for field in FIELDS}
+    result = {"id": row_id, **row}
+    cache_key = followup_cache_key(row, []) if cache is not None else None
+    try:
+        output = cache.get(cache_key) if cache is not None else None
+        if output is None:
+            output = await assess(client, limiter, row, max_attempts)
+        parsed = parse_followup(output)
+        if parsed["evidence_q"] is None or parsed["explanation_q"] is None:
+            raise ValueError("GPT output format error")
+        if cache is not None:
+            cache.put(cache_key, output)
+        result.update(parsed)
+        result["raw"] = output
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+async def run(args):
+    done = completed_ids(args.output)
+    pending = [(row_id, row) for row_id, row in read_reflections(args.input) if row_id not in done]
+    print(f"{len(done)} already graded, {len(pending)} to go", file=sys.stderr)
+
+    client = AsyncOpenAI(max_retries=0, timeout=args.timeout)
+    limiter = HeaderRateLimiter()
+    cache = ResponseCache(args.cache) if args.cache else None
+    queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+
+    counts = {"ok": 0, "error": 0}
+    started = time.monotonic()
+    with open(args.output, "a", encoding="utf-8") as out:
+        async def worker():
+            while True:
+                try:
+                    row_id, row = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                result = await grade_row(client, limiter, cache, row_id, row, args.max_attempts)
+                # Written and flushed per row so an interrupted run can resume
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                counts["error" if result.get("error") else "ok"] += 1
+                finished = counts["ok"] + counts["error"]
+                if finished % 50 == 0 or finished == len(pending):
+                    rate = finished / max(time.monotonic() - started, 1e-9)
+                    print(f"{finished}/{len(pending)} graded ({counts['error']} errors, {rate:.1f} rows/s)",
+                          file=sys.stderr)
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return 1 if counts["error"] else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the follow-up rubric assessment over an exported CSV/JSONL of reflections."
+    )
+    parser.add_argument("input", help="CSV or .jsonl with names, research_question, evidence, meaning (and optional id)")
+    parser.add_argument("output", help="JSONL file results are appended to; rerun with the same file to resume")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight at once (default: 8)")
+    parser.add_argument("--max-attempts", type=int, default=6, help="attempts per row on 429/5xx (default: 6)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    parser.add_argument("--cache", help="optional response cache SQLite path shared with the app")
+    parser.add_argument("--log-usage", action="store_true", help="log token usage and latency for every call")
+    args = parser.parse_args(argv)
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if args.log_usage:
+        logging.getLogger("assessment").setLevel(logging.INFO)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import logging
+import re
+import threading
+import time
+import metrics
+from admission import call_with_admission
+from assessment import (MODEL, TEMPERATURE, RUBRIC_PROMPT, build_student_message, parse_followup, record_usage,
+                        repeated_questions)
+
+logger = logging.getLogger(__name__)
+
+FAST_MODEL = "gpt-4o-mini"
+
+# Only the fast model is asked for this; the full model's prompt is unchanged.
+# RUBRIC_PROMPT asks for score ranges, which would make every answer look
+# borderline, so the fast model gives whole scores and rates its confidence.
+CONFIDENCE_INSTRUCTION = """
+For this response, instead of a range, give a single whole-number score (1, 2, 3 or 4) for each rubric.
+After the follow-up questions, add one final line saying how sure you are (0-100) that both scores are correct and not borderline between two levels:
+Confidence: [number]
+"""
+
+_CONFIDENCE_PATTERN = re.compile(r"^[-*\s]*Confidence:\W*(\d+(?:\.\d+)?)\s*%?\s*$", re.IGNORECASE | re.MULTILINE)
+
+
+def build_fast_messages(initial_answers, history):
+    return [
+        {"role": "system", "content": RUBRIC_PROMPT + CONFIDENCE_INSTRUCTION},
+        {"role": "user", "content": build_student_message(initial_answers, history)},
+    ]
+
+
+def split_confidence(text):
+    # Returns the response without its confidence line, and the confidence as
+    # a fraction (None if the model left it out)
+    match = _CONFIDENCE_PATTERN.search(text)
+    if match is None:
+        return text.strip(), None
+    confidence = min(float(match.group(1)), 100.0) / 100
+    return (text[:match.start()] + text[match.end():]).strip(), confidence
+
+
+def escalation_reason(parsed, confidence, min_confidence, history=()):
+    # None means the fast answer can be used as is
+    if not (parsed["evidence_q"] and parsed["explanation_q"]):
+        return "unparsed"
+    if history and repeated_questions(parsed, history):
+        return "repeated"
+    scores = (parsed["evidence_score"], parsed["explanation_score"])
+    if None in scores:
+        return "unparsed"
+    # Asked for whole scores; a range or half score means it could not decide
+    if any(score != int(score) for score in scores):
+        return "borderline"
+    if confidence is None:
+        return "no_confidence"
+    if confidence < min_confidence:
+        return "low_confidence"
+    return None
+
+
+# --- Fast first pass with escalation ---
+class Cascade:
+    # `client` is anything with chat.completions.create: an OpenAI client,
+    # one pointed at the bench's fake server, or bench.fake_servers.StubOpenAI.
+    # The full-model call itself stays with the caller, which reports its
+    # latency through observe_full() so savings can be estimated.
+    def __init__(self, client, controller=None, fast_model=FAST_MODEL, full_model=MODEL,
+                 min_confidence=0.8, temperature=TEMPERATURE):
+        self.client = client
+        self.controller = controller
+        self.fast_model = fast_model
+        self.full_model = full_model
+        self.min_confidence = min_confidence
+        self.temperature = temperature
+        self._lock = threading.Lock()
+        self._full_latency = None
+        self._calls = 0
+        self._escalations = {}
+        self._latency_saved = 0.0
+
+    def first_pass(self, initial_answers, history, on_wait=None, on_retry=None, background=False,
+                   cancelled=None):
+        # Returns (text, reason): text is None when the case should go to the
+        # full model, and reason says why.
+        timing = {}
+
+        def create():
+            timing["started"] = time.perf_counter()
+            return self.client.chat.completions.create(
+                model=self.fast_model,
+                messages=build_fast_messages(initial_answers, history),
+                temperature=self.temperature,
+            )
+
+        if self.controller is None:
+            response = create()
+        else:
+            response = call_with_admission(self.controller, create, on_wait=on_wait, on_retry=on_retry,
+                                           background=background, cancelled=cancelled)
+        latency = time.perf_counter() - timing["started"]
+        record_usage(response.usage, latency, model=self.fast_model, source="cascade")
+
+        text, confidence = split_confidence(response.choices[0].message.content or "")
+        reason = escalation_reason(parse_followup(text), confidence, self.min_confidence, history)
+        self._record(latency, reason)
+        return (text if reason is None else None), reason
+
+    def observe_full(self, latency):
+        # Moving average of full-model latency, the baseline for "saved"
+        with self._lock:
+            if self._full_latency is None:
+                self._full_latency = latency
+            else:
+                self._full_latency += 0.1 * (latency - self._full_latency)
+
+    def _record(self, latency, reason):
+        with self._lock:
+            self._calls += 1
+            if reason is None:
+                saved = max(0.0, (self._full_latency or latency) - latency)
+                self._latency_saved += saved
+            else:
+                self._escalations[reason] = self._escalations.get(reason, 0) + 1
+                self._latency_saved -= latency
+        metrics.inc("cascade_total", outcome="accepted" if reason is None else "escalated", reason=reason or "")
+        metrics.observe("cascade_fast_seconds", latency, model=self.fast_model)
+        if reason is None:
+            metrics.inc("cascade_latency_saved_seconds_total", saved)
+        else:
+            metrics.inc("cascade_escalation_overhead_seconds_total", latency)
+            logger.info("escalating to %s: %s", self.full_model, reason)
+
+    def stats(self):
+        with self._lock:
+            escalated = sum(self._escalations.values())
+            return {
+                "calls": self._calls,
+                "escalated": escalated,
+                "escalation_rate": escalated / self._calls if self._calls else None,
+                "escalation_reasons": dict(self._escalations),
+                "full_latency_estimate": self._full_latency,
+                # Net of the time spent on fast calls that were escalated anyway
+                "latency_saved_seconds": self._latency_saved,
+            }
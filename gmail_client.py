@@ -0,0 +1,94 @@
+import base64
+import datetime
+import threading
+from email.mime.text import MIMEText
+import google_auth_httplib2
+import httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+from google.auth.transport.requests import Request
+import metrics
+
+SCOPES = ['https://www.googleapis.com/auth/gmail.send']
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+
+# --- Process-wide Gmail credentials + service ---
+class GmailClient:
+    # token_uri and api_endpoint can point at local fakes for testing;
+    # request_factory supplies the google-auth transport used for refreshes
+    # and http_factory the httplib2-style transport used for Gmail calls.
+    def __init__(self, secrets, token_uri=None, api_endpoint=None,
+                 refresh_margin_seconds=300, request_factory=Request,
+                 http_factory=httplib2.Http):
+        self._secrets = secrets
+        self._token_uri = token_uri or secrets.get("token_uri", TOKEN_URI)
+        self._api_endpoint = api_endpoint or secrets.get("api_endpoint")
+        self._refresh_margin = datetime.timedelta(seconds=refresh_margin_seconds)
+        self._request_factory = request_factory
+        self._http_factory = http_factory
+        self._lock = threading.Lock()
+        self._creds = None
+        self._service = None
+
+    def _needs_refresh(self):
+        if self._creds.token is None or self._creds.expiry is None:
+            return True
+        # google-auth stores expiry as a naive UTC datetime
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return self._creds.expiry - now <= self._refresh_margin
+
+    def credentials(self):
+        with self._lock:
+            if self._creds is None:
+                self._creds = Credentials(
+                    token=None,
+                    refresh_token=self._secrets["refresh_token"],
+                    token_uri=self._token_uri,
+                    client_id=self._secrets["client_id"],
+                    client_secret=self._secrets["client_secret"],
+                    scopes=SCOPES,
+                )
+            if self._needs_refresh():
+                with metrics.timer("gmail_token_refresh_seconds"):
+                    self._creds.refresh(self._request_factory())
+            return self._creds
+
+    def _build_request(self, http, *args, **kwargs):
+        # httplib2 connections are not thread-safe, so every API request gets
+        # its own transport while sharing the one service and credentials.
+        authed_http = google_auth_httplib2.AuthorizedHttp(self.credentials(), http=self._http_factory())
+        return HttpRequest(authed_http, *args, **kwargs)
+
+    def service(self):
+        creds = self.credentials()
+        with self._lock:
+            if self._service is None:
+                client_options = {"api_endpoint": self._api_endpoint} if self._api_endpoint else None
+                # static_discovery uses the discovery document bundled with
+                # google-api-python-client instead of fetching it over HTTP.
+                self._service = build(
+                    'gmail', 'v1',
+                    http=google_auth_httplib2.AuthorizedHttp(creds, http=self._http_factory()),
+                    requestBuilder=self._build_request,
+                    static_discovery=True,
+                    cache_discovery=False,
+                    client_options=client_options,
+                )
+            return self._service
+
+    def send(self, to, subject, body_text):
+        service = self.service()
+
+        message = MIMEText(body_text)
+        message['To'] = to
+        message['From'] = 'me'
+        message['Subject'] = subject
+
+        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+        body = {'raw': raw_message}
+
+        with metrics.timer("gmail_send_seconds"):
+            sent = service.users().messages().send(userId='me', body=body).execute()
+        return sent['id']
@@ -0,0 +1,177 @@
+import bisect
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _bucket_bounds(low=0.001, high=600.0, factor=1.2):
+    bounds = [low]
+    while bounds[-1] < high:
+        bounds.append(bounds[-1] * factor)
+    return bounds
+
+
+# Geometric buckets from 1ms to 10min: quantiles are accurate to within ~10%
+# while observe() stays a bisect and an increment.
+BUCKET_BOUNDS = _bucket_bounds()
+
+
+# --- Histogram ---
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for idx, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = BUCKET_BOUNDS[idx - 1] if idx > 0 else 0.0
+                upper = BUCKET_BOUNDS[idx] if idx < len(BUCKET_BOUNDS) else BUCKET_BOUNDS[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKET_BOUNDS[-1]
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(f'{k}="{str(v)}"' for k, v in pairs)
+    return "{" + inner + "}"
+
+
+# --- Registry ---
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        # Records `name` in seconds; failures also count toward errors_total
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.inc("errors_total", span=name, error=type(e).__name__)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = []
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                entry = {"name": name, "labels": dict(labels), "count": histogram.count, "sum": histogram.sum}
+                for q in QUANTILES:
+                    entry[f"p{round(q * 100)}"] = histogram.quantile(q)
+                histograms.append(entry)
+        return {"timestamp": time.time(), "counters": counters, "histograms": histograms}
+
+    def prometheus_text(self):
+        lines = []
+        typed = set()
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} summary")
+                    typed.add(name)
+                for q in QUANTILES:
+                    value = histogram.quantile(q)
+                    lines.append(f"{name}{_format_labels(labels, [('quantile', q)])} {value if value is not None else 'NaN'}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+
+# --- Exporters ---
+def start_http_exporter(port, host="127.0.0.1", registry=REGISTRY):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return server
+
+
+def start_jsonl_exporter(path, interval=60.0, registry=REGISTRY):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(registry.snapshot()) + "\n")
+            except OSError:
+                logger.exception("Could not write metrics to %s", path)
+
+    thread = threading.Thread(target=run, name="metrics-jsonl", daemon=True)
+    thread.start()
+    return thread
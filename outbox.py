@@ -0,0 +1,302 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+WAITING_FOR_DIGEST = "waiting_for_digest"
+
+
+def normalize_recipient(address):
+    return address.strip().lower()
+
+
+# --- Digest formatting ---
+def digest_subject(items):
+    return f"Lab Investigation Summaries ({len(items)} report{'s' if len(items) != 1 else ''})"
+
+
+def digest_body(items):
+    parts = []
+    for idx, (_, subject, body) in enumerate(items, start=1):
+        parts.append(f"=== Report {idx} of {len(items)}: {subject} ===\n\n{body.rstrip()}\n")
+    return "\n\n".join(parts)
+
+
+# --- Persisted email outbox with a background sender ---
+class Outbox:
+    # With digest_window_seconds set, enqueue_for_digest() collects reports per
+    # recipient and sends one combined message per window or per
+    # digest_max_reports, whichever comes first.
+    def __init__(self, path, send_fn, max_attempts=6, base_delay=2.0, max_delay=300.0,
+                 poll_interval=1.0, sending_lease=120.0, digest_window_seconds=None,
+                 digest_max_reports=20, retention_seconds=7 * 24 * 3600, prune_interval=3600.0):
+        self.path = path
+        self.send_fn = send_fn
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.sending_lease = sending_lease
+        self.digest_window_seconds = digest_window_seconds
+        self.digest_max_reports = digest_max_reports
+        self.retention_seconds = retention_seconds
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS outbox (
+                key TEXT PRIMARY KEY,
+                recipient TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                message_id TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS digest_items (
+                key TEXT PRIMARY KEY,
+                recipient TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                digest_key TEXT
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS digest_items_pending ON digest_items (digest_key, recipient)"
+        )
+
+    def enqueue(self, key, to, subject, body):
+        # Re-enqueueing the same key (page reruns, refreshes) is a no-op, and so
+        # is enqueueing a key that is already in a digest.
+        self._insert_once(
+            key, "digest_items",
+            "INSERT OR IGNORE INTO outbox "
+            "(key, recipient, subject, body, status, next_attempt_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            lambda now: (key, to, subject, body, QUEUED, now, now, now),
+        )
+        return self.status(key)
+
+    def enqueue_for_digest(self, key, to, subject, body):
+        # A key already queued on its own (digest mode was off) stays there
+        self._insert_once(
+            key, "outbox",
+            "INSERT OR IGNORE INTO digest_items (key, recipient, subject, body, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            lambda now: (key, normalize_recipient(to), subject, body, now),
+        )
+        return self.status(key)
+
+    def enqueue_report(self, key, to, subject, body):
+        # Follows this outbox's own digest setting
+        enqueue = self.enqueue_for_digest if self.digest_window_seconds else self.enqueue
+        return enqueue(key, to, subject, body)
+
+    def _insert_once(self, key, other_table, sql, params):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._conn.execute(f"SELECT 1 FROM {other_table} WHERE key = ?", (key,)).fetchone() is None:
+                    self._conn.execute(sql, params(now))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._wake.set()
+
+    def status(self, key):
+        with self._lock:
+            item = self._conn.execute(
+                "SELECT digest_key FROM digest_items WHERE key = ?", (key,)
+            ).fetchone()
+        if item is not None:
+            if item[0] is None:
+                return {"status": WAITING_FOR_DIGEST, "attempts": 0, "message_id": None, "error": None}
+            key = item[0]
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, attempts, message_id, error FROM outbox WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"status": row[0], "attempts": row[1], "message_id": row[2], "error": row[3]}
+
+    def retry(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._conn.execute(
+                "SELECT digest_key FROM digest_items WHERE key = ?", (key,)
+            ).fetchone()
+            if item is not None and item[0] is not None:
+                key = item[0]
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ? "
+                "WHERE key = ? AND status = ?",
+                (QUEUED, now, now, key, FAILED),
+            )
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+            self._thread.start()
+        return self
+
+    def _claim(self):
+        now = time.time()
+        with self._lock:
+            # Rows left in "sending" by a crashed worker go back in the queue
+            self._conn.execute(
+                "UPDATE outbox SET status = ? WHERE status = ? AND updated_at < ?",
+                (QUEUED, SENDING, now - self.sending_lease),
+            )
+            row = self._conn.execute(
+                "SELECT key, recipient, subject, body, attempts FROM outbox "
+                "WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT 1",
+                (QUEUED, now),
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = self._conn.execute(
+                "UPDATE outbox SET status = ?, updated_at = ? WHERE key = ? AND status = ?",
+                (SENDING, now, row[0], QUEUED),
+            ).rowcount
+        return row if claimed else None
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return random.uniform(delay / 2, delay)
+
+    def process_one(self):
+        row = self._claim()
+        if row is None:
+            return False
+        key, to, subject, body, attempts = row
+        attempts += 1
+        try:
+            message_id = self.send_fn(to, subject, body)
+        except Exception as e:
+            now = time.time()
+            status = FAILED if attempts >= self.max_attempts else QUEUED
+            metrics.inc("email_failed_total" if status == FAILED else "email_retries_total")
+            logger.warning("Email %s attempt %d failed: %s", key, attempts, e)
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, error = ?, "
+                    "updated_at = ? WHERE key = ?",
+                    (status, attempts, now + self._backoff(attempts), str(e), now, key),
+                )
+            return True
+        metrics.inc("email_sent_total")
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, message_id = ?, error = NULL, "
+                "updated_at = ? WHERE key = ?",
+                (SENT, attempts, message_id, time.time(), key),
+            )
+        return True
+
+    def flush_digests(self, force=False):
+        # If digest mode has been turned off, reports still waiting go out now
+        force = force or self.digest_window_seconds is None
+        now = time.time()
+        window = self.digest_window_seconds or 0
+        flushed = 0
+        with self._lock:
+            groups = self._conn.execute(
+                "SELECT lower(trim(recipient)), COUNT(*), MIN(created_at) FROM digest_items "
+                "WHERE digest_key IS NULL GROUP BY lower(trim(recipient))"
+            ).fetchall()
+            for recipient, count, oldest in groups:
+                if not force and count < self.digest_max_reports and now - oldest < window:
+                    continue
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    items = self._conn.execute(
+                        "SELECT key, subject, body FROM digest_items "
+                        "WHERE digest_key IS NULL AND lower(trim(recipient)) = ? ORDER BY created_at LIMIT ?",
+                        (recipient, self.digest_max_reports),
+                    ).fetchall()
+                    if not items:
+                        self._conn.execute("ROLLBACK")
+                        continue
+                    digest_key = f"digest:{items[0][0]}"
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO outbox "
+                        "(key, recipient, subject, body, status, next_attempt_at, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (digest_key, recipient, digest_subject(items), digest_body(items),
+                         QUEUED, now, now, now),
+                    )
+                    self._conn.executemany(
+                        "UPDATE digest_items SET digest_key = ? WHERE key = ?",
+                        [(digest_key, item[0]) for item in items],
+                    )
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                flushed += 1
+        return flushed
+
+    def prune(self):
+        # Sent messages are only kept long enough to answer status() for
+        # sessions that may still be open; keep retention_seconds well above
+        # the session idle timeout so a resumed session never re-sends.
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "DELETE FROM digest_items WHERE digest_key IN "
+                    "(SELECT key FROM outbox WHERE status = ? AND updated_at < ?)",
+                    (SENT, cutoff),
+                )
+                pruned = self._conn.execute(
+                    "DELETE FROM outbox WHERE status = ? AND updated_at < ?", (SENT, cutoff)
+                ).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return pruned
+
+    def _run(self):
+        last_prune = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_prune >= self.prune_interval:
+                    last_prune = time.monotonic()
+                    self.prune()
+                self.flush_digests()
+                if self.process_one():
+                    continue
+            except Exception:
+                logger.exception("Email outbox worker error")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
@@ -0,0 +1,98 @@
+import hmac
+import pandas as pd
+import streamlit as st
+from analytics import AnalyticsStore
+
+st.set_page_config(page_title="Teacher Analytics", layout="wide")
+st.title("Teacher Analytics")
+
+
+# --- Analytics Store ---
+@st.cache_resource
+def get_analytics_store():
+    return AnalyticsStore(st.secrets.get("ANALYTICS_PATH", ".cache/analytics.sqlite3"))
+
+
+# --- Passcodes ---
+# ANALYTICS_PASSCODE opens every teacher's data (admins); ANALYTICS_PASSCODES
+# maps a teacher's email address to a passcode that opens only their reports.
+def match_passcode(entered):
+    # Returns the teacher the passcode belongs to, None for the admin passcode,
+    # or False if it matches nothing
+    matched = False
+    for teacher, passcode in teacher_passcodes.items():
+        if hmac.compare_digest(entered.encode("utf-8"), str(passcode).encode("utf-8")):
+            matched = teacher
+    if admin_passcode and hmac.compare_digest(entered.encode("utf-8"), str(admin_passcode).encode("utf-8")):
+        matched = None
+    return matched
+
+
+admin_passcode = st.secrets.get("ANALYTICS_PASSCODE")
+teacher_passcodes = {
+    teacher.strip().lower(): passcode for teacher, passcode in st.secrets.get("ANALYTICS_PASSCODES", {}).items()
+}
+if not (admin_passcode or teacher_passcodes):
+    st.warning("🔒 Set `ANALYTICS_PASSCODE` or `ANALYTICS_PASSCODES` in the app secrets to open this page.")
+    st.stop()
+if "analytics_scope" not in st.session_state:
+    entered = st.text_input("Passcode", type="password")
+    if not entered:
+        st.stop()
+    scope = match_passcode(entered)
+    if scope is False:
+        st.error("❌ Incorrect passcode.")
+        st.stop()
+    st.session_state.analytics_scope = scope
+    st.rerun()
+
+store = get_analytics_store()
+
+# --- Teacher Filter ---
+# A teacher's passcode only ever shows their own reports
+teacher = st.session_state.analytics_scope
+if teacher is None:
+    teachers = store.teachers()
+    if not teachers:
+        st.info("No reports have been submitted yet.")
+        st.stop()
+    choice = st.selectbox("Teacher", ["All teachers"] + [t["teacher"] for t in teachers])
+    teacher = None if choice == "All teachers" else choice
+else:
+    st.caption(f"Reports sent to {teacher}")
+    if not store.totals(teacher)["reports"]:
+        st.info("No reports have been submitted yet.")
+        st.stop()
+
+# --- Totals ---
+totals = store.totals(teacher)
+col1, col2, col3 = st.columns(3)
+col1.metric("Reports", totals["reports"])
+col2.metric("Revision rounds", totals["rounds"])
+col3.metric("Average rounds per report", f"{totals['average_rounds']:.1f}" if totals["average_rounds"] is not None else "–")
+
+# --- Score Distributions ---
+st.subheader("Score distribution")
+st.caption("The last assessment is the latest feedback the student saw, on the draft before the one they finished with.")
+scores = pd.DataFrame(store.score_distribution(teacher), columns=["rubric", "stage", "score", "reports"])
+for column, rubric in zip(st.columns(2), ("evidence", "explanation")):
+    with column:
+        st.markdown(f"**{rubric.title()}** (first vs. last assessment)")
+        chart = (
+            scores[scores["rubric"] == rubric]
+            .pivot_table(index="score", columns="stage", values="reports", aggfunc="sum", fill_value=0)
+        )
+        if chart.empty:
+            st.caption("No scores yet.")
+        else:
+            chart.index = chart.index.map(lambda score: f"{score:g}")
+            st.bar_chart(chart)
+
+# --- Round Counts ---
+st.subheader("Revision rounds per report")
+rounds = pd.DataFrame(store.round_distribution(teacher), columns=["rounds", "reports"])
+st.bar_chart(rounds.set_index("rounds"))
+
+# --- Research Questions ---
+st.subheader("Research questions")
+st.dataframe(pd.DataFrame(store.research_questions(teacher)), hide_index=True)
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def _normalize(text):
+    return " ".join(str(text or "").split())
+
+
+def make_cache_key(research_question, evidence, meaning, asked_questions, model, prompt_version):
+    payload = json.dumps(
+        [
+            _normalize(research_question),
+            _normalize(evidence),
+            _normalize(meaning),
+            [_normalize(q) for q in asked_questions],
+            model,
+            prompt_version,
+        ],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# --- SQLite-backed LRU cache with TTL ---
+class ResponseCache:
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, ttl_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        # Running total of stored bytes, kept in step by put/get/_evict so
+        # they never have to sum the table. Resynced once on open.
+        self._conn.execute(
+            "INSERT INTO counters (name, value) VALUES ('bytes', (SELECT COALESCE(SUM(size), 0) FROM responses)) "
+            "ON CONFLICT(name) DO UPDATE SET value = excluded.value"
+        )
+
+    def _bump(self, name, amount=1):
+        self._conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at, size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._bump("bytes", -row[2])
+                self._bump("expired")
+                self._conn.execute("COMMIT")
+                row = None
+            if row is None:
+                self._bump("misses")
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._bump("hits")
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        # Would only evict everything else and then itself
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now),
+                )
+                self._bump("bytes", size - (old[0] if old else 0))
+                self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, batch=32):
+        # Drops least recently used entries, a small batch at a time, until
+        # the running total fits
+        total = self._conn.execute("SELECT value FROM counters WHERE name = 'bytes'").fetchone()[0]
+        evicted = 0
+        freed = 0
+        while total - freed > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_used ASC LIMIT ?", (batch,)
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total - freed <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                freed += size
+                evicted += 1
+        if evicted:
+            self._bump("bytes", -freed)
+            self._bump("evictions", evicted)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "expired": counters.get("expired", 0),
+            "evictions": counters.get("evictions", 0),
+            "entries": entries,
+            "bytes": counters.get("bytes", 0),
+        }
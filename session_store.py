@@ -0,0 +1,213 @@
+import abc
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Follow-up history entries are stored as flat JSON arrays in this order
+HISTORY_FIELDS = (
+    ("question", "evidence_q"),
+    ("question", "evidence_person"),
+    ("question", "explanation_q"),
+    ("question", "explanation_person"),
+    ("answer", "updated_evidence"),
+    ("answer", "updated_meaning"),
+)
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def pack_entry(entry):
+    return _dumps([entry[group][field] for group, field in HISTORY_FIELDS])
+
+
+def unpack_entry(packed):
+    entry = {"question": {}, "answer": {}}
+    for (group, field), value in zip(HISTORY_FIELDS, json.loads(packed)):
+        entry[group][field] = value
+    return entry
+
+
+# --- Session stores ---
+# A store keeps two things per session: a small state dict that is rewritten
+# as a whole, and the follow-up history, which is only ever appended to.
+class SessionStore(abc.ABC):
+    def __init__(self, max_idle_seconds=6 * 3600, evict_interval=60.0):
+        self.max_idle_seconds = max_idle_seconds
+        self.evict_interval = evict_interval
+        self._last_evict = time.monotonic()
+
+    @abc.abstractmethod
+    def load(self, session_id):
+        ...
+
+    @abc.abstractmethod
+    def save_state(self, session_id, state):
+        ...
+
+    @abc.abstractmethod
+    def append_history(self, session_id, index, entry):
+        ...
+
+    @abc.abstractmethod
+    def evict_idle(self):
+        ...
+
+    def _maybe_evict(self):
+        now = time.monotonic()
+        if now - self._last_evict >= self.evict_interval:
+            self._last_evict = now
+            self.evict_idle()
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        # Ordered by last use, so idle sessions are always at the front
+        self._sessions = collections.OrderedDict()
+
+    def _touch(self, session_id):
+        record = self._sessions.get(session_id)
+        if record is None:
+            record = self._sessions[session_id] = {"state": "{}", "history": [], "touched": 0.0}
+        record["touched"] = time.time()
+        self._sessions.move_to_end(session_id)
+        return record
+
+    def load(self, session_id):
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                return None
+            self._touch(session_id)
+            return {
+                "state": json.loads(record["state"]),
+                "history": [unpack_entry(packed) for packed in record["history"]],
+            }
+
+    def save_state(self, session_id, state):
+        with self._lock:
+            self._touch(session_id)["state"] = _dumps(state)
+        self._maybe_evict()
+
+    def append_history(self, session_id, index, entry):
+        with self._lock:
+            history = self._touch(session_id)["history"]
+            # Replayed appends (e.g. after a rerun) are ignored
+            if index == len(history):
+                history.append(pack_entry(entry))
+        self._maybe_evict()
+
+    def evict_idle(self):
+        cutoff = time.time() - self.max_idle_seconds
+        evicted = 0
+        with self._lock:
+            while self._sessions:
+                session_id, record = next(iter(self._sessions.items()))
+                if record["touched"] >= cutoff:
+                    break
+                del self._sessions[session_id]
+                evicted += 1
+        return evicted
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                touched REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched)")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS history (
+                session_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                entry TEXT NOT NULL,
+                PRIMARY KEY (session_id, idx)
+            ) WITHOUT ROWID"""
+        )
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE sessions SET touched = ? WHERE session_id = ?", (time.time(), session_id)
+            )
+            history = self._conn.execute(
+                "SELECT entry FROM history WHERE session_id = ? ORDER BY idx", (session_id,)
+            ).fetchall()
+        return {
+            "state": json.loads(row[0]),
+            "history": [unpack_entry(packed) for (packed,) in history],
+        }
+
+    def save_state(self, session_id, state):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, state, touched) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET state = excluded.state, touched = excluded.touched",
+                (session_id, _dumps(state), time.time()),
+            )
+        self._maybe_evict()
+
+    def append_history(self, session_id, index, entry):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO history (session_id, idx, entry) VALUES (?, ?, ?)",
+                (session_id, index, pack_entry(entry)),
+            )
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, state, touched) VALUES (?, '{}', ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET touched = excluded.touched",
+                (session_id, now),
+            )
+        self._maybe_evict()
+
+    def evict_idle(self):
+        cutoff = time.time() - self.max_idle_seconds
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "DELETE FROM history WHERE session_id IN "
+                    "(SELECT session_id FROM sessions WHERE touched < ?)",
+                    (cutoff,),
+                )
+                evicted = self._conn.execute(
+                    "DELETE FROM sessions WHERE touched < ?", (cutoff,)
+                ).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return evicted
+
+
+def open_session_store(kind="memory", path=None, max_idle_seconds=6 * 3600):
+    if kind == "memory":
+        return MemorySessionStore(max_idle_seconds=max_idle_seconds)
+    if kind == "sqlite":
+        return SQLiteSessionStore(path or ".cache/sessions.sqlite3", max_idle_seconds=max_idle_seconds)
+    raise ValueError(f"Unknown session store: {kind}")
@@ -0,0 +1,64 @@
+import threading
+import time
+import metrics
+
+
+# --- Per-session speculative work ---
+class Speculator:
+    # observe() is called with a key describing the inputs the next request
+    # would use. Once the key has been stable for debounce_seconds, start() is
+    # submitted to the executor with a cancel Event; a later key change cancels
+    # it. take() hands back the result only if it was started for the same key
+    # and has already finished.
+    def __init__(self, executor, debounce_seconds=3.0):
+        self._executor = executor
+        self.debounce_seconds = debounce_seconds
+        self._draft_key = None
+        self._draft_since = 0.0
+        self._key = None
+        self._future = None
+        self._cancel_event = None
+
+    def observe(self, key, start):
+        now = time.monotonic()
+        if key != self._draft_key:
+            self._draft_key = key
+            self._draft_since = now
+        if self._key is not None and self._key != key:
+            self.cancel()
+        if self._key is None and now - self._draft_since >= self.debounce_seconds:
+            self._cancel_event = threading.Event()
+            self._key = key
+            self._future = self._executor.submit(start, self._cancel_event)
+            metrics.inc("speculation_started_total")
+            return True
+        return False
+
+    def reset(self):
+        # Forget the current draft so the debounce starts over
+        self.cancel()
+        self._draft_key = None
+
+    def take(self, key):
+        # Never waits: a request still running is cancelled, so the caller can
+        # stream its own instead of blocking on this one
+        if self._key != key or self._future is None or not self._future.done():
+            if self._future is not None:
+                self.cancel()
+            metrics.inc("speculation_misses_total")
+            return None
+        future = self._future
+        self._key = self._future = self._cancel_event = None
+        try:
+            result = future.result()
+        except Exception:
+            result = None
+        metrics.inc("speculation_hits_total" if result is not None else "speculation_misses_total")
+        return result
+
+    def cancel(self):
+        if self._future is not None:
+            self._cancel_event.set()
+            self._future.cancel()
+            metrics.inc("speculation_cancelled_total")
+        self._key = self._future = self._cancel_event = None
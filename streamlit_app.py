@@ -1,55 +1,102 @@
+import time
+APP_STARTED = time.perf_counter()
+
 import streamlit as st
-import base64
-import os
+from streamlit.errors import StreamlitAPIException
+import json
+import logging
+import functools
 import random
-from email.mime.text import MIMEText
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-from openai import OpenAI
-
-SCOPES = ['https://www.googleapis.com/auth/gmail.send']
-secrets = st.secrets["google_auth"]
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from outbox import Outbox, QUEUED, SENDING, SENT, FAILED, WAITING_FOR_DIGEST
+from response_cache import ResponseCache
+from admission import AdmissionCancelled, AdmissionController, call_with_admission
+from session_store import open_session_store
+from speculation import Speculator
+from cascade import Cascade
+from analytics import AnalyticsStore
+from assessment import (MODEL, TEMPERATURE, build_followup_messages, parse_followup, followup_cache_key,
+                        record_usage, repeated_questions)
+
+# The Gmail and OpenAI client libraries are slow to import, so they are only
+# loaded on first use (see get_gmail_client / get_openai_client) and then
+# kept as process-wide singletons.
+
+logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s")
+logging.getLogger("assessment").setLevel(logging.INFO)
+logging.getLogger("streamlit_app").setLevel(logging.INFO)
+logging.getLogger("cascade").setLevel(logging.INFO)
 
 # --- Gmail Setup ---
-def load_credentials():
-    secrets = st.secrets["google_auth"]
-    creds = Credentials(
-        token=None,
-        refresh_token=secrets["refresh_token"],
-        token_uri="https://oauth2.googleapis.com/token",
-        client_id=secrets["client_id"],
-        client_secret=secrets["client_secret"],
-        scopes=["https://www.googleapis.com/auth/gmail.send"],
+@st.cache_resource
+def get_gmail_client():
+    from gmail_client import GmailClient
+    return GmailClient(st.secrets["google_auth"])
+
+
+# --- Email Outbox ---
+@st.cache_resource
+def get_outbox():
+    gmail = get_gmail_client()
+    return Outbox(
+        st.secrets.get("OUTBOX_PATH", ".cache/outbox.sqlite3"),
+        gmail.send,
+        max_attempts=int(st.secrets.get("OUTBOX_MAX_ATTEMPTS", 6)),
+        # Digest mode is off (one email per report) unless a window is configured
+        digest_window_seconds=max(0.0, float(st.secrets.get("EMAIL_DIGEST_MINUTES", 0))) * 60 or None,
+        digest_max_reports=int(st.secrets.get("EMAIL_DIGEST_MAX_REPORTS", 20)),
+        retention_seconds=float(st.secrets.get("OUTBOX_RETENTION_DAYS", 7)) * 86400,
+    ).start()
+
+
+# --- OpenAI Setup ---
+if "OPENAI_API_KEY" not in st.secrets:
+    st.error("❌ OPENAI_API_KEY not found. Please check your .streamlit/secrets.toml or environment variables.")
+    st.stop()
+
+
+@st.cache_resource
+def get_openai_client():
+    from openai import OpenAI
+    # Retries are handled by call_with_admission so they respect the rate limit.
+    # OPENAI_BASE_URL lets benchmarks point the app at a local fake server.
+    return OpenAI(
+        api_key=st.secrets["OPENAI_API_KEY"],
+        base_url=st.secrets.get("OPENAI_BASE_URL"),
+        max_retries=0,
     )
-    if creds.expired or not creds.valid:
-        creds.refresh(Request())
-    return creds
 
 
-def send_email(to, subject, body_text):
-    creds = load_credentials()
-    service = build('gmail', 'v1', credentials=creds)
+@st.cache_resource
+def get_admission_controller():
+    # Shared by every session in this process; no limit unless one is configured
+    return AdmissionController(
+        rate_per_minute=float(st.secrets.get("OPENAI_REQUESTS_PER_MINUTE", 0)) or None,
+        burst=int(st.secrets.get("OPENAI_BURST", 5)),
+    )
 
-    message = MIMEText(body_text)
-    message['To'] = to
-    message['From'] = 'me'
-    message['Subject'] = subject
 
-    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    body = {'raw': raw_message}
+def create_completion(on_wait=None, on_retry=None, client=None, controller=None, background=False,
+                      cancelled=None, **kwargs):
+    # Returns the response and the API latency (excluding time spent queued).
+    # Background threads pass client/controller in rather than using st.* here.
+    timing = {}
 
-    sent = service.users().messages().send(userId='me', body=body).execute()
-    return sent['id']
+    client = client or get_openai_client()
+    controller = controller or get_admission_controller()
 
+    def create():
+        timing["started"] = time.perf_counter()
+        return client.chat.completions.create(**kwargs)
+
+    response = call_with_admission(controller, create, on_wait=on_wait, on_retry=on_retry,
+                                   background=background, cancelled=cancelled)
+    return response, timing["started"]
 
 
-# --- OpenAI Setup ---
-try:
-    client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-except KeyError:
-    st.error("❌ OPENAI_API_KEY not found. Please check your .streamlit/secrets.toml or environment variables.")
-    st.stop()
 def pick_random_names(name_string, used_names, count=2):
     names = [name.strip() for name in name_string.split(",") if name.strip()]
     if len(names) < count:
@@ -64,157 +111,287 @@ def pick_random_names(name_string, used_names, count=2):
     return chosen, None
 
 
+# --- Response Cache ---
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(
+        st.secrets.get("RESPONSE_CACHE_PATH", ".cache/followup_responses.sqlite3"),
+        max_bytes=int(st.secrets.get("RESPONSE_CACHE_MAX_MB", 50)) * 1024 * 1024,
+        ttl_seconds=int(st.secrets.get("RESPONSE_CACHE_TTL_HOURS", 168)) * 3600,
+    )
+
+
+def cache_get(cache, key):
+    # A cache error (e.g. the shared SQLite file is locked) counts as a miss
+    try:
+        return cache.get(key)
+    except sqlite3.Error as e:
+        logging.getLogger("streamlit_app").warning("Response cache read failed: %s", e)
+        return None
+
+
+def cache_put(cache, key, value):
+    try:
+        cache.put(key, value)
+    except sqlite3.Error as e:
+        logging.getLogger("streamlit_app").warning("Response cache write failed: %s", e)
+
+
+# --- Model Cascade ---
+# Opt-in: CASCADE_FAST_MODEL answers first and only borderline or
+# low-confidence cases are escalated to MODEL.
+CASCADE_FAST_MODEL = st.secrets.get("CASCADE_FAST_MODEL")
+# Cached answers are only reused under the same model setup
+ASSESSMENT_MODEL = f"{CASCADE_FAST_MODEL}>{MODEL}" if CASCADE_FAST_MODEL else MODEL
+
+
+@st.cache_resource
+def get_cascade():
+    if not CASCADE_FAST_MODEL:
+        return None
+    return Cascade(
+        get_openai_client(),
+        get_admission_controller(),
+        fast_model=CASCADE_FAST_MODEL,
+        min_confidence=float(st.secrets.get("CASCADE_MIN_CONFIDENCE", 0.8)),
+    )
+
+
+def fast_followup(cascade, initial_answers, history, on_wait=None, on_retry=None, background=False,
+                  cancelled=None):
+    # The fast model's answer, or None if the full model should take it
+    if cascade is None:
+        return None
+    try:
+        text, _ = cascade.first_pass(initial_answers, history, on_wait=on_wait, on_retry=on_retry,
+                                     background=background, cancelled=cancelled)
+        return text
+    except AdmissionCancelled:
+        raise
+    except Exception as e:
+        logging.getLogger("streamlit_app").warning("Fast model failed, escalating: %s", e)
+        return None
+
+
 # --- AI Follow-Up Generator ---
-def generate_followup_question(initial_answers, history):
-    previous_qs = [h["question"] for h in history]
-
-    prompt = f"""
-You are assessing student science investigation reflections using two rubrics:
-
-Rubric 1: Presenting Evidence
-- 1 ("Getting There"): Lists what they saw, measured, or noticed; points to evidence but does not clearly connect it to the research question.
-- 2 ("Partial Solid"): Includes some relevant evidence, but descriptions are general OR misses patterns, contrasts, or possible relationships.
-- 3 ("Solid"): Presents a range of specific evidence clearly tied to the research question AND describes key patterns, contrasts, or cause-effect relationships.
-- 4 ("Excellent"): Selects specific, relevant evidence; describes patterns or relationships; AND highlights limitations, uncertainty, or suggests additional data that would improve clarity.
-
-Rubric 2: Constructing an Explanation
-- 1 ("Getting There"): Says what they think the evidence means; suggests a reason but without clear logical flow.
-- 2 ("Partial Solid"): Begins to connect evidence to reasoning, but the logic is incomplete OR cause-effect ideas are missing or unclear.
-- 3 ("Solid"): Strings together a clear explanation that spells out cause-effect connections explcitly with mechanisms or clear reasoning. Answers the research question AND shows how evidence backs up the explanation through cause-and-effect.
-- 4 ("Excellent"): Builds a cause-effect explanation AND connects it to scientific ideas (energy flow, matter changes, or scale/quantity); recognizes gaps, limitations, or alternative explanations.
-
----
-
-Scoring Rules:
-- Match your reasoning explicitly to rubric words like "specific evidence," "patterns," "cause-effect," "uncertainty," "additional data."
-- Give a range of possible scores, using half scores if needed.
-- Use the second person to refer to the student personally.
-- Be brief but clear: 1-2 sentences justifying each score, focusing only on the positive items completed.
-
-Follow-Up Question Rules:
-- If either score is 1 or 2, start with a comment along the lines of: "This feedback is meant to guide you to immediately improve your work. Use these questions to guide your revision, then submit."
-- If Evidence Score is 1 → Ask for more specific evidence, closely connected to the research question.
-- If Evidence Scores is 2 → Ask for patterns, contrasts, or clearer tie to research question.
-- If Evidence Score is 3 → Ask about uncertainty, limitations, or additional data that could strengthen the evidence.
-- If Evidence Score is 4 → Ask about generalizing to new materials, conditions, or variables.
-- If Explanation Score is 1 → Ask for a clear reason why things happened how they did, using cause-effect.
-- If Explanation Score is 2 → Ask for stronger cause-effect reasoning that ties evidence directly to the research question.
-- If Explanation Score is 3 → Ask for connection to scientific ideas (energy, matter, or scale) OR recognition of possible gaps or alternatives.
-- If Explanation Score is 4 → Ask for deeper particle-level reasoning OR critical evaluation of alternative explanations.
-
-All follow-up questions must be open-ended (cannot be answered "yes" or "no").
-
----
-
-Now assess this new student:
-
-Student Initial Answers:
-- Research Question: {initial_answers['research_question']}
-- Present Evidence: {initial_answers['evidence']}
-- Construct an Explanation: {initial_answers['meaning']}
-
-Already Asked Questions: {previous_qs}
-
-Instructions:
-- Provide friendly, clear rubric-based reasoning for evidence and explanation.
-- Assign 1–4 scores for each.
-- Write two open-ended follow-up questions (one for evidence, one for explanation) that push the student one level higher based on their scores.
-- Do not repeat any already-asked questions.
-
-Return your response cleanly structured like this:
-
-Assessment:
-- Evidence: Evidence Score: [number]  
-- Explanation: Explanation Score: [number]
-
-Follow-Up Questions:
-- Evidence Question: [question here]
-- Explanation Question: [question here]
-"""
+def usable_followup(followup_output, history):
+    # Complete, and not just re-asking a question from an earlier round
+    parsed = parse_followup(followup_output)
+    if not (parsed["evidence_q"] and parsed["explanation_q"]):
+        return False
+    if repeated_questions(parsed, history):
+        metrics.inc("repeated_questions_total")
+        return False
+    return True
+
+
+def _cache_if_valid(cache_key, followup_output, history):
+    if usable_followup(followup_output, history):
+        cache_put(get_response_cache(), cache_key, followup_output)
+
+
+def stream_followup_question(initial_answers, history, on_wait=None, on_retry=None, avoid=()):
+    # Yields text deltas as the model produces them. `avoid` re-asks the full
+    # model after it repeated an earlier round's question.
+    cache_key = followup_cache_key(initial_answers, history, ASSESSMENT_MODEL)
+    cached = None if avoid else cache_get(get_response_cache(), cache_key)
+    metrics.inc("response_cache_total", result="miss" if cached is None else "hit")
+    if cached is not None:
+        yield cached
+        return
+
+    cascade = get_cascade()
+    fast_output = None if avoid else fast_followup(cascade, initial_answers, history, on_wait, on_retry)
+    if fast_output is not None:
+        _cache_if_valid(cache_key, fast_output, history)
+        yield fast_output
+        return
+
+    messages = build_followup_messages(initial_answers, history, avoid)
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7
+        stream, started = create_completion(
+            on_wait=on_wait,
+            on_retry=on_retry,
+            model=MODEL,
+            messages=messages,
+            temperature=TEMPERATURE,
+            stream=True,
+            stream_options={"include_usage": True}
         )
-        followup_output = response.choices[0].message.content.strip()
-        return followup_output
+        deltas = []
+        usage = None
+        for chunk in stream:
+            # The final chunk carries usage and no choices
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not deltas:
+                    metrics.observe("openai_first_token_seconds", time.perf_counter() - started)
+                deltas.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        latency = time.perf_counter() - started
+        record_usage(usage, latency)
+        if cascade is not None:
+            cascade.observe_full(latency)
+        _cache_if_valid(cache_key, "".join(deltas).strip(), history)
     except Exception as e:
         st.error(f"❌ Error generating follow-up assessment: {e}")
         st.stop()
 
 
+# --- Speculative Pre-Generation ---
+# Opt-in: once a group's revised drafts stop changing, the next assessment is
+# requested in the background so "Submit Revisions" can use it right away.
+SPECULATIVE_MODE = bool(st.secrets.get("SPECULATIVE_MODE", False))
 
-# --- Email Summary Generator ---
-def create_summary(initial_answers, followup_history):
-    summary = f"""Student Names: {initial_answers['names']}
-Research Question: {initial_answers['research_question']}
-Current Final Evidence: {initial_answers['evidence']}
-Current Final Interpretation: {initial_answers['meaning']}
 
-Initial Evidence Collected: {initial_answers['first_evidence']}
-Initial Interpretation: {initial_answers['first_meaning']}
+@st.cache_resource
+def get_speculation_executor():
+    return ThreadPoolExecutor(
+        max_workers=int(st.secrets.get("SPECULATION_WORKERS", 8)),
+        thread_name_prefix="speculate",
+    )
 
-Follow-Up Discussion:
-"""
-    for idx, entry in enumerate(followup_history, start=1):
-        summary += f"\nQ{idx} Evidence for {entry['question']['evidence_person']}: {entry['question']['evidence_q']}\n"
-        summary += f"A{idx} Evidence: {entry['answer']['updated_evidence']}\n\n"
-        summary += f"Q{idx} Explanation for {entry['question']['explanation_person']}: {entry['question']['explanation_q']}\n"
-        summary += f"A{idx} Explanation: {entry['answer']['updated_meaning']}\n\n"
-    return summary
-
-# --- Submit Functions ---
-def submit_revisions():
-    evidence = st.session_state.current_draft["evidence"]
-    meaning = st.session_state.current_draft["meaning"]
-
-    if evidence.strip() == "" or meaning.strip() == "":
-        st.session_state.submit_error = "Please complete both revised sections before submitting."
+
+def get_speculator():
+    if "speculator" not in st.session_state:
+        st.session_state.speculator = Speculator(
+            get_speculation_executor(),
+            debounce_seconds=float(st.secrets.get("SPECULATION_DEBOUNCE_SECONDS", 3)),
+        )
+    return st.session_state.speculator
+
+
+def speculate_followup(initial_answers, history, client, controller, cache, cascade, cancel_event):
+    # Runs on the speculation executor, so it only uses the objects passed in
+    cache_key = followup_cache_key(initial_answers, history, ASSESSMENT_MODEL)
+    cached = cache_get(cache, cache_key)
+    if cached is not None:
+        return cached
+    if cancel_event.is_set():
+        return None
+    try:
+        fast_output = fast_followup(cascade, initial_answers, history, background=True,
+                                    cancelled=cancel_event.is_set)
+        if fast_output is not None:
+            cache_put(cache, cache_key, fast_output)
+            return fast_output
+        if cancel_event.is_set():
+            return None
+
+        # Queued behind every regular submit, so speculation never delays one.
+        # A request cancelled while still queued gives up its place and never
+        # takes a rate token.
+        stream, started = create_completion(
+            client=client,
+            controller=controller,
+            background=True,
+            cancelled=cancel_event.is_set,
+            model=MODEL,
+            messages=build_followup_messages(initial_answers, history),
+            temperature=TEMPERATURE,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+    except AdmissionCancelled:
+        return None
+    deltas = []
+    usage = None
+    for chunk in stream:
+        # Stop paying for tokens as soon as the drafts change
+        if cancel_event.is_set():
+            stream.close()
+            return None
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            deltas.append(chunk.choices[0].delta.content)
+    latency = time.perf_counter() - started
+    record_usage(usage, latency, source="speculative")
+    if cascade is not None:
+        cascade.observe_full(latency)
+
+    followup_output = "".join(deltas).strip()
+    if not usable_followup(followup_output, history):
+        return None
+    cache_put(cache, cache_key, followup_output)
+    return followup_output
+
+
+@st.fragment(run_every=1.0)
+def speculation_ticker():
+    # Renders nothing; checks once a second whether the drafts have settled
+    if st.session_state.current_followup is None:
+        return
+    speculator = get_speculator()
+    evidence = st.session_state.get("updated_evidence", "")
+    meaning = st.session_state.get("updated_meaning", "")
+    unchanged = (evidence == st.session_state.initial_answers["evidence"]
+                 and meaning == st.session_state.initial_answers["meaning"])
+    if unchanged or not evidence.strip() or not meaning.strip():
+        speculator.reset()
         return
 
-    st.session_state.followup_history.append({
-        "question": {
-            "evidence_q": st.session_state.current_evidence_q,
-            "evidence_person": st.session_state.current_evidence_person,
-            "explanation_q": st.session_state.current_explanation_q,
-            "explanation_person": st.session_state.current_explanation_person
-        },
-        "answer": {
-            "updated_evidence": evidence,
-            "updated_meaning": meaning
-        }
-    })
-
-    st.session_state.initial_answers["evidence"] = evidence
-    st.session_state.initial_answers["meaning"] = meaning
-    st.session_state.current_followup = generate_followup_question(
-        {
-            "names": st.session_state.initial_answers["names"],
-            "research_question": st.session_state.initial_answers["research_question"],
-            "evidence": evidence,
-            "meaning": meaning,
-            "teacher_email": st.session_state.initial_answers["teacher_email"],
-        },
-        st.session_state.followup_history
+    # Exactly what "Submit Revisions" would send for these drafts
+    answers = dict(st.session_state.initial_answers, evidence=evidence, meaning=meaning)
+    history = st.session_state.followup_history + [make_followup_entry(evidence, meaning)]
+    speculator.observe(
+        followup_cache_key(answers, history, ASSESSMENT_MODEL),
+        functools.partial(
+            speculate_followup, answers, history,
+            get_openai_client(), get_admission_controller(), get_response_cache(), get_cascade(),
+        ),
     )
 
-    # After generating a new question, reset the draft
-    st.session_state.current_draft["evidence"] = st.session_state.initial_answers["evidence"]
-    st.session_state.current_draft["meaning"] = st.session_state.initial_answers["meaning"]
 
-    st.session_state.submit_error = None
-    st.rerun()
+# --- Session Store ---
+# Everything needed to resume a report on another replica or after a restart.
+# The follow-up history is stored separately and only appended to.
+SESSION_FIELDS = (
+    "mode",
+    "initial_answers",
+    "current_followup",
+    "used_names",
+    "current_evidence_person",
+    "current_explanation_person",
+    "updated_evidence",
+    "updated_meaning",
+    "first_scores",
+)
+
+
+@st.cache_resource
+def get_session_store():
+    return open_session_store(
+        st.secrets.get("SESSION_STORE", "memory"),
+        st.secrets.get("SESSION_STORE_PATH", ".cache/sessions.sqlite3"),
+        max_idle_seconds=float(st.secrets.get("SESSION_IDLE_HOURS", 6)) * 3600,
+    )
 
-def finish_and_send_summary():
-    evidence = st.session_state.current_draft["evidence"]
-    meaning = st.session_state.current_draft["meaning"]
 
-    if evidence.strip() == "" or meaning.strip() == "":
-        st.session_state.submit_error = "Please complete both revised sections before submitting."
-        return
+def restore_session(session_id):
+    saved = get_session_store().load(session_id)
+    if saved is None:
+        return False
+    for field, value in saved["state"].items():
+        st.session_state[field] = value
+    st.session_state.used_names = set(st.session_state.get("used_names", []))
+    st.session_state.followup_history = saved["history"]
+    return True
+
+
+def persist_session():
+    state = {field: st.session_state[field] for field in SESSION_FIELDS if field in st.session_state}
+    state["used_names"] = sorted(state.get("used_names", ()))
+    # Only write when something actually changed since the last save
+    snapshot = json.dumps(state, sort_keys=True)
+    if snapshot != st.session_state.get("persisted_snapshot"):
+        get_session_store().save_state(st.session_state.session_id, state)
+        st.session_state.persisted_snapshot = snapshot
 
-    st.session_state.followup_history.append({
+
+def make_followup_entry(evidence, meaning):
+    return {
         "question": {
             "evidence_q": st.session_state.current_evidence_q,
             "evidence_person": st.session_state.current_evidence_person,
@@ -225,108 +402,104 @@ def finish_and_send_summary():
             "updated_evidence": evidence,
             "updated_meaning": meaning
         }
-    })
+    }
 
-    st.session_state.initial_answers["evidence"] = evidence
-    st.session_state.initial_answers["meaning"] = meaning
 
-    st.session_state.mode = "send_summary"
-    st.session_state.submit_error = None
-    st.rerun()
+def append_followup(entry):
+    history = st.session_state.followup_history
+    get_session_store().append_history(st.session_state.session_id, len(history), entry)
+    history.append(entry)
 
 
-# --- Streamlit Front-End ---
-st.set_page_config(page_title="Lab Report Reflection", layout="wide")
-st.title("Lab Report Reflection")
+# --- Class Analytics ---
+@st.cache_resource
+def get_analytics_store():
+    return AnalyticsStore(st.secrets.get("ANALYTICS_PATH", ".cache/analytics.sqlite3"))
 
-# --- Rubric Display ---
-st.markdown("""
-### Rubrics for Reflection
-<small><i>Use these rubrics to guide your investigation answers and reflections:</i></small>
 
-<div style='font-size: 70%;'>
+def record_report():
+    # Once per session; the store also ignores repeats of the same session
+    if st.session_state.get("report_recorded"):
+        return
+    answers = st.session_state.initial_answers
+    # The last assessment shown, which covers the draft before the finished one
+    last_scores = None
+    if st.session_state.current_followup:
+        last_scores = rubric_scores(current_assessment())
+    try:
+        get_analytics_store().record_report(
+            st.session_state.session_id,
+            answers["teacher_email"],
+            answers["research_question"],
+            len(st.session_state.followup_history),
+            st.session_state.get("first_scores"),
+            last_scores,
+        )
+    except Exception:
+        # Analytics must never stop a summary from being sent
+        logging.getLogger("streamlit_app").exception("Could not record report for analytics")
+        return
+    st.session_state.report_recorded = True
 
-| Skill | Getting There | Solid | Excellent |
-|:------|:--------------|:------|:----------|
-| **Present Evidence** | • List what you saw, measured, or noticed during the investigation<br>• Point to key evidence that connects to the research question. | • Present a range of specific evidence that helps clearly answer the research question.<br>• Describe key patterns, contrasts, or possible relationships in the evidence. | • Highlight limitations of the evidence or key points of uncertainty or unexpected results.<br>• Suggest additional data that would make an answer clearer or more certain. |
-| **Construct an Explanation** | • Say what you think the evidence means, or what it shows about the research question.<br>• Suggest a reason why it might have happened this way. | • String together a clear explanation that answers the research question.<br>• Show how the evidence backs up this explanation, using a clear cause-and-effect idea. | • Connect your explanation to ideas about energy, matter changes, or scale and quantity.<br>• Point out any gaps or limitations in your ideas, or other possible explanations. |
 
-</div>
-""", unsafe_allow_html=True)
+# --- Email Summary Generator ---
+def iter_summary(initial_answers, followup_history):
+    # Yields the summary one round at a time, so it can be streamed or written
+    # out without building intermediate copies of a long history
+    yield f"""Student Names: {initial_answers['names']}
+Research Question: {initial_answers['research_question']}
+Current Final Evidence: {initial_answers['evidence']}
+Current Final Interpretation: {initial_answers['meaning']}
 
-# --- Session State Initialization ---
-if "initial_answers" not in st.session_state:
-    st.session_state.initial_answers = {}
-if "followup_history" not in st.session_state:
-    st.session_state.followup_history = []
-if "current_followup" not in st.session_state:
-    st.session_state.current_followup = None
-if "current_draft" not in st.session_state:
-    st.session_state.current_draft = {}
-if "mode" not in st.session_state:
-    st.session_state.mode = "input"
-if "used_names" not in st.session_state:
-    st.session_state.used_names = set()
-if "submit_error" not in st.session_state:
-    st.session_state.submit_error = None
+Initial Evidence Collected: {initial_answers['first_evidence']}
+Initial Interpretation: {initial_answers['first_meaning']}
 
-# --- Input Phase ---
-if st.session_state.mode == "input":
-    st.subheader("Step 1: Fill in your investigation details")
+Follow-Up Discussion:
+"""
+    for idx, entry in enumerate(followup_history, start=1):
+        yield (
+            f"\nQ{idx} Evidence for {entry['question']['evidence_person']}: {entry['question']['evidence_q']}\n"
+            f"A{idx} Evidence: {entry['answer']['updated_evidence']}\n\n"
+            f"Q{idx} Explanation for {entry['question']['explanation_person']}: {entry['question']['explanation_q']}\n"
+            f"A{idx} Explanation: {entry['answer']['updated_meaning']}\n\n"
+        )
 
-    names = st.text_input("0. What are your names? (Separate with commas)")
-    name_list = [n.strip() for n in names.split(",") if n.strip()]
-    if len(name_list) < 2 and names:
-        st.warning("⚠️ This activity is meant for a group. Try to find more people to work with.")
-    
-    research_question = st.text_area("1. What is your research question?")
-    evidence = st.text_area("2. What did you see or measure? List key evidence that helps answer the research question, plus context.")
-    meaning = st.text_area("3. What might this mean? What can you figure out, based on this evidence?")
-    teacher_email = st.text_input("4. What is your teacher's email address?")
 
+def create_summary(initial_answers, followup_history):
+    return "".join(iter_summary(initial_answers, followup_history))
 
-    if st.button("Submit Answers"):
-        if not (names and research_question and evidence and meaning and teacher_email):
-            st.error("❌ Please fill out all fields before submitting.")
-        else:
-            st.session_state.initial_answers = {
-                "names": names,
-                "research_question": research_question,
-                "evidence": evidence,
-                "meaning": meaning,
-                "teacher_email": teacher_email,
-                "first_evidence": evidence,
-                "first_meaning": meaning
-            }
-            st.session_state.current_draft = {
-                "evidence": evidence,
-                "meaning": meaning
-            }
-            st.session_state.mode = "followup"
-            st.rerun()
+# --- Follow-Up Round ---
+def rerun_followup_round():
+    # A fragment-scoped rerun is only allowed while the fragment is rerunning
+    # on its own; on a full script run fall back to rerunning the page.
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
 
-# --- Follow-Up Phase ---
-elif st.session_state.mode == "followup":
-    st.subheader("Step 2: Reflect and Revise Your Thinking")
 
-    if st.session_state.current_followup is None:
-        with st.spinner("Generating feedback..."):
-            st.session_state.current_followup = generate_followup_question(
-                st.session_state.initial_answers, st.session_state.followup_history
-            )
-
-    # Parse GPT response
-    followup_parts = st.session_state.current_followup.split("Follow-Up Questions:")
-    if len(followup_parts) != 2:
-        st.error("❌ GPT output format error.")
-        st.stop()
+def rubric_scores(parsed):
+    return {"evidence": parsed["evidence_score"], "explanation": parsed["explanation_score"]}
 
-    assessment_part = followup_parts[0].strip()
-    questions_part = followup_parts[1].strip()
-    lines = questions_part.split("\n")
-    evidence_q = lines[0].replace("Evidence Question:", "").strip()
-    explanation_q = lines[1].replace("Explanation Question:", "").strip()
 
+def current_assessment():
+    # Parsed once per assessment, not on every rerun
+    text = st.session_state.current_followup
+    cached = st.session_state.get("parsed_followup")
+    if cached is None or cached[0] != text:
+        cached = (text, parse_followup(text))
+        st.session_state.parsed_followup = cached
+        # Kept for the class analytics: how the very first assessment scored
+        if "first_scores" not in st.session_state:
+            st.session_state.first_scores = rubric_scores(cached[1])
+    return cached[1]
+
+
+# Typing and "Submit Revisions" only rerun this fragment; the page header and
+# rubric table are left alone. Finishing switches mode and reruns the page.
+@st.fragment
+def followup_round():
+    metrics.inc("fragment_runs_total", fragment="followup_round")
     # Assign partner names ONLY if not already assigned
     if "current_evidence_person" not in st.session_state or "current_explanation_person" not in st.session_state:
         name_input = st.session_state.initial_answers.get("names", "")
@@ -341,6 +514,18 @@ elif st.session_state.mode == "followup":
     evidence_person = st.session_state.current_evidence_person
     explanation_person = st.session_state.current_explanation_person
 
+    # Parse GPT response (still streaming in if None)
+    pending = st.session_state.current_followup is None
+    if pending:
+        parsed = parse_followup("", complete=False)
+    else:
+        parsed = current_assessment()
+        if parsed["evidence_q"] is None or parsed["explanation_q"] is None:
+            st.error("❌ GPT output format error.")
+            st.stop()
+
+    evidence_q = parsed["evidence_q"]
+    explanation_q = parsed["explanation_q"]
 
     # Always re-assign the questions from GPT (those change each round)
     st.session_state.current_evidence_q = evidence_q
@@ -355,73 +540,233 @@ elif st.session_state.mode == "followup":
 
     # Show Assessment + Follow-Ups
     st.markdown("### 📋 AI Assessment of Your Previous Answers:")
-    st.markdown(assessment_part)
+    assessment_box = st.empty()
+    assessment_box.markdown(parsed["assessment"])
 
     st.markdown("### ✏️ Revise or Extend Your Thinking:")
 
-    st.markdown(f"**Evidence Follow-Up Question for {evidence_person}:** {evidence_q}")
-    st.text_area("Revise your Evidence:", key="updated_evidence", height=150)
+    # Drafts are locked while feedback streams: editing would rerun the page
+    # and drop the in-flight response.
+    evidence_q_box = st.empty()
+    evidence_q_box.markdown(f"**Evidence Follow-Up Question for {evidence_person}:** {evidence_q or '...'}")
+    st.text_area("Revise your Evidence:", key="updated_evidence", height=150, disabled=pending)
 
-    st.markdown(f"**Explanation Follow-Up Question for {explanation_person}:** {explanation_q}")
-    st.text_area("Revise your Explanation:", key="updated_meaning", height=150)
+    explanation_q_box = st.empty()
+    explanation_q_box.markdown(f"**Explanation Follow-Up Question for {explanation_person}:** {explanation_q or '...'}")
+    st.text_area("Revise your Explanation:", key="updated_meaning", height=150, disabled=pending)
 
     col1, col2 = st.columns(2)
     with col1:
-        if st.button("Submit Revisions"):
+        if st.button("Submit Revisions", disabled=pending):
             evidence = st.session_state.updated_evidence
             meaning = st.session_state.updated_meaning
             if evidence.strip() == "" or meaning.strip() == "":
                 st.session_state.submit_error = "Please complete both revised sections before submitting."
             else:
-                st.session_state.followup_history.append({
-                    "question": {
-                        "evidence_q": evidence_q,
-                        "evidence_person": evidence_person,
-                        "explanation_q": explanation_q,
-                        "explanation_person": explanation_person
-                    },
-                    "answer": {
-                        "updated_evidence": evidence,
-                        "updated_meaning": meaning
-                    }
-                })
+                append_followup(make_followup_entry(evidence, meaning))
                 st.session_state.initial_answers["evidence"] = evidence
                 st.session_state.initial_answers["meaning"] = meaning
-                st.session_state.current_followup = generate_followup_question(
-                    st.session_state.initial_answers,
-                    st.session_state.followup_history
-                )
-                st.rerun()
+                # The next run streams the new assessment in place, unless a
+                # speculative request already finished it for exactly this text
+                st.session_state.current_followup = None
+                if SPECULATIVE_MODE:
+                    cache_key = followup_cache_key(
+                        st.session_state.initial_answers, st.session_state.followup_history, ASSESSMENT_MODEL
+                    )
+                    st.session_state.current_followup = get_speculator().take(cache_key)
+                st.session_state.submit_error = None
+                persist_session()
+                rerun_followup_round()
 
     with col2:
-        if st.button("Finish and Send Summary"):
+        if st.button("Finish and Send Summary", disabled=pending):
             evidence = st.session_state.updated_evidence
             meaning = st.session_state.updated_meaning
 
             if evidence.strip() == "" or meaning.strip() == "":
                 st.session_state.submit_error = "Please complete both revised sections before submitting."
             else:
-                st.session_state.followup_history.append({
-                    "question": {
-                        "evidence_q": evidence_q,
-                        "evidence_person": evidence_person,
-                        "explanation_q": explanation_q,
-                        "explanation_person": explanation_person
-                    },
-                    "answer": {
-                        "updated_evidence": evidence,
-                        "updated_meaning": meaning
-                    }
-                })
+                append_followup(make_followup_entry(evidence, meaning))
                 st.session_state.initial_answers["evidence"] = evidence
                 st.session_state.initial_answers["meaning"] = meaning
                 st.session_state.mode = "send_summary"
                 st.session_state.submit_error = None
+                if SPECULATIVE_MODE:
+                    get_speculator().cancel()
+                persist_session()
                 st.rerun()
 
     if st.session_state.submit_error:
         st.error(f"❌ {st.session_state.submit_error}")
 
+    # Keeps drafts and name assignments so another replica can resume
+    persist_session()
+
+    # Stream the assessment into the placeholders above as tokens arrive
+    if pending:
+        queue_box = st.empty()
+
+        def show_queue_position(position):
+            if position > 1:
+                queue_box.info(f"⏳ Lots of groups are submitting right now. You're #{position} in line for feedback...")
+            else:
+                queue_box.info("⏳ You're next in line for feedback...")
+
+        def show_retry(attempt, delay):
+            queue_box.info("⏳ The feedback service is busy. Trying again in a moment...")
+
+        # A question repeated from an earlier round is re-asked once, with the
+        # repeat named in the prompt; the second answer is kept either way
+        avoid = []
+        for attempt in range(2):
+            text = ""
+            with st.spinner("Generating feedback..."):
+                for delta in stream_followup_question(
+                    st.session_state.initial_answers, st.session_state.followup_history,
+                    on_wait=show_queue_position, on_retry=show_retry, avoid=avoid
+                ):
+                    queue_box.empty()
+                    text += delta
+                    partial = parse_followup(text, complete=False)
+                    assessment_box.markdown(partial["assessment"])
+                    if partial["evidence_q"]:
+                        evidence_q_box.markdown(f"**Evidence Follow-Up Question for {evidence_person}:** {partial['evidence_q']}")
+                    if partial["explanation_q"]:
+                        explanation_q_box.markdown(f"**Explanation Follow-Up Question for {explanation_person}:** {partial['explanation_q']}")
+            avoid = repeated_questions(parse_followup(text), st.session_state.followup_history)
+            if not avoid:
+                break
+            queue_box.info("⏳ Finding you a new question...")
+        st.session_state.current_followup = text.strip()
+        persist_session()
+        rerun_followup_round()
+
+
+# --- Streamlit Front-End ---
+st.set_page_config(page_title="Lab Report Reflection", layout="wide")
+st.title("Lab Report Reflection")
+
+# --- Rubric Display ---
+st.markdown("""
+### Rubrics for Reflection
+<small><i>Use these rubrics to guide your investigation answers and reflections:</i></small>
+
+<div style='font-size: 70%;'>
+
+| Skill | Getting There | Solid | Excellent |
+|:------|:--------------|:------|:----------|
+| **Present Evidence** | • List what you saw, measured, or noticed during the investigation<br>• Point to key evidence that connects to the research question. | • Present a range of specific evidence that helps clearly answer the research question.<br>• Describe key patterns, contrasts, or possible relationships in the evidence. | • Highlight limitations of the evidence or key points of uncertainty or unexpected results.<br>• Suggest additional data that would make an answer clearer or more certain. |
+| **Construct an Explanation** | • Say what you think the evidence means, or what it shows about the research question.<br>• Suggest a reason why it might have happened this way. | • String together a clear explanation that answers the research question.<br>• Show how the evidence backs up this explanation, using a clear cause-and-effect idea. | • Connect your explanation to ideas about energy, matter changes, or scale and quantity.<br>• Point out any gaps or limitations in your ideas, or other possible explanations. |
+
+</div>
+""", unsafe_allow_html=True)
+
+# --- Cache Stats (for tuning) ---
+if st.secrets.get("SHOW_CACHE_STATS", False):
+    with st.sidebar.expander("Response cache"):
+        st.json(get_response_cache().stats())
+    if get_cascade() is not None:
+        with st.sidebar.expander("Model cascade"):
+            st.json(get_cascade().stats())
+
+# --- Session State Initialization ---
+# The session id lives in the URL so any replica can pick the session back up
+if "session_id" not in st.session_state:
+    session_id = st.query_params.get("sid")
+    if not (session_id and restore_session(session_id)):
+        session_id = uuid.uuid4().hex
+        st.query_params["sid"] = session_id
+    st.session_state.session_id = session_id
+if "initial_answers" not in st.session_state:
+    st.session_state.initial_answers = {}
+if "followup_history" not in st.session_state:
+    st.session_state.followup_history = []
+if "current_followup" not in st.session_state:
+    st.session_state.current_followup = None
+if "mode" not in st.session_state:
+    st.session_state.mode = "input"
+if "used_names" not in st.session_state:
+    st.session_state.used_names = set()
+if "submit_error" not in st.session_state:
+    st.session_state.submit_error = None
+
+# --- Startup Timing ---
+@st.cache_resource
+def startup_timing():
+    return {"first_run_ms": None}
+
+
+timing = startup_timing()
+if timing["first_run_ms"] is None:
+    # Time from the first script run starting to the page being ready to
+    # render in a fresh process; watch this for cold start regressions.
+    timing["first_run_ms"] = round((time.perf_counter() - APP_STARTED) * 1000)
+    logging.getLogger("streamlit_app").info("cold start: first run ready in %d ms", timing["first_run_ms"])
+    metrics.observe("cold_start_seconds", timing["first_run_ms"] / 1000)
+
+# --- Metrics ---
+@st.cache_resource
+def start_metrics_exporters():
+    port = st.secrets.get("METRICS_PORT")
+    if port:
+        try:
+            metrics.start_http_exporter(int(port), host=st.secrets.get("METRICS_HOST", "127.0.0.1"))
+        except OSError:
+            # e.g. another app process on this host already serves the port;
+            # metrics must never stop students from working
+            logging.getLogger("streamlit_app").exception("Could not serve metrics on port %s", port)
+    path = st.secrets.get("METRICS_JSONL_PATH")
+    if path:
+        metrics.start_jsonl_exporter(path, interval=float(st.secrets.get("METRICS_JSONL_INTERVAL", 60)))
+    return True
+
+
+start_metrics_exporters()
+# Started on every replica, so emails queued before a restart are retried and
+# waiting digests go out without waiting for another group to finish here
+get_outbox()
+metrics.inc("script_runs_total", phase=st.session_state.mode)
+
+# --- Input Phase ---
+if st.session_state.mode == "input":
+    st.subheader("Step 1: Fill in your investigation details")
+
+    names = st.text_input("0. What are your names? (Separate with commas)")
+    name_list = [n.strip() for n in names.split(",") if n.strip()]
+    if len(name_list) < 2 and names:
+        st.warning("⚠️ This activity is meant for a group. Try to find more people to work with.")
+    
+    research_question = st.text_area("1. What is your research question?")
+    evidence = st.text_area("2. What did you see or measure? List key evidence that helps answer the research question, plus context.")
+    meaning = st.text_area("3. What might this mean? What can you figure out, based on this evidence?")
+    teacher_email = st.text_input("4. What is your teacher's email address?")
+
+
+    if st.button("Submit Answers"):
+        if not (names and research_question and evidence and meaning and teacher_email):
+            st.error("❌ Please fill out all fields before submitting.")
+        else:
+            st.session_state.initial_answers = {
+                "names": names,
+                "research_question": research_question,
+                "evidence": evidence,
+                "meaning": meaning,
+                "teacher_email": teacher_email,
+                "first_evidence": evidence,
+                "first_meaning": meaning
+            }
+            st.session_state.mode = "followup"
+            persist_session()
+            st.rerun()
+
+# --- Follow-Up Phase ---
+elif st.session_state.mode == "followup":
+    st.subheader("Step 2: Reflect and Revise Your Thinking")
+
+    followup_round()
+    if SPECULATIVE_MODE:
+        speculation_ticker()
+
 
 # --- Email Sending Phase ---
 elif st.session_state.mode == "send_summary":
@@ -429,15 +774,39 @@ elif st.session_state.mode == "send_summary":
 
     email_body = create_summary(st.session_state.initial_answers, st.session_state.followup_history)
 
-    try:
-        message_id = send_email(
-            st.session_state.initial_answers["teacher_email"],
-            subject=f"{st.session_state.initial_answers['names']} - Lab Investigation Summary",
-            body_text=email_body
-        )
-        st.success(f"✅ Email sent successfully! Message ID: {message_id}")
-    except Exception as e:
-        st.error(f"❌ Failed to send email: {e}")
+    # Queued once per session; the outbox worker sends it in the background
+    outbox_key = f"{st.session_state.session_id}:summary"
+    outbox = get_outbox()
+    outbox.enqueue_report(
+        outbox_key,
+        st.session_state.initial_answers["teacher_email"],
+        subject=f"{st.session_state.initial_answers['names']} - Lab Investigation Summary",
+        body=email_body
+    )
+
+    # Poll only until the email is sent or has failed for good
+    email_final = outbox.status(outbox_key)["status"] in (SENT, FAILED)
+
+    @st.fragment(run_every=None if email_final else 2)
+    def show_email_status():
+        outbox = get_outbox()
+        status = outbox.status(outbox_key)
+        if not email_final and status["status"] in (SENT, FAILED):
+            st.rerun()
+        if status["status"] == WAITING_FOR_DIGEST:
+            st.info("📨 Your summary is queued and will be included in your teacher's next summary email.")
+        elif status["status"] in (QUEUED, SENDING):
+            st.info("📨 Your summary is queued and will be sent to your teacher shortly.")
+        elif status["status"] == SENT:
+            st.success(f"✅ Email sent successfully! Message ID: {status['message_id']}")
+        elif status["status"] == FAILED:
+            st.error(f"❌ Failed to send email: {status['error']}")
+            if st.button("Try Sending Again"):
+                outbox.retry(outbox_key)
+                st.rerun()
+
+    show_email_status()
+    record_report()
 
     # ✅ Always show the email summary
     st.subheader("📬 Email Preview")
@@ -447,3 +816,10 @@ elif st.session_state.mode == "send_summary":
 
     st.info("You may now close this window. Thanks for your hard work!")
 
+    # Otherwise reloading a shared device reopens this group's report
+    if st.button("Start a new report"):
+        if "sid" in st.query_params:
+            del st.query_params["sid"]
+        st.session_state.clear()
+        st.rerun()
+